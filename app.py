@@ -3,27 +3,287 @@ SoundScan - Audio Copyright Song Detector
 Accepts audio file uploads and detects copyrighted music with timestamps.
 """
 
+import io
 import os
 import json
+import hmac
+import hashlib
+import itertools
+import mmap
 import tempfile
+import time
+import queue
+import select
+import threading
 import subprocess
+from functools import partial
 from pathlib import Path
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+
+import decoder
+import probe
+from backends import AudDBackend, LocalBackend, MockBackend, Router, parse_audd_result, time_left
+from cache import ResultCache
+from fingerprint import FingerprintIndex
+from jobs import JobQueue
+from features import chunk_peak_levels, music_scores, repeat_clusters
 
 app = Flask(__name__)
 CORS(app)
 
 # Configuration
 AUDD_API_TOKEN = os.environ.get('AUDD_API_TOKEN', '')
+AUDD_API_URL = 'https://api.audd.io/'
 
 # Chunk configuration
 CHUNK_DURATION = 12  # seconds per chunk
 OVERLAP = 4  # seconds overlap between chunks
 
+# Recognition concurrency
+RECOGNITION_WORKERS = int(os.environ.get('RECOGNITION_WORKERS', '4'))  # default per-request limit
+MAX_RECOGNITION_WORKERS = int(os.environ.get('MAX_RECOGNITION_WORKERS', '16'))  # cap on the per-request limit
+AUDD_MAX_CONCURRENCY = int(os.environ.get('AUDD_MAX_CONCURRENCY', '8'))  # process-wide AudD calls in flight
+AUDD_SLOTS = threading.BoundedSemaphore(AUDD_MAX_CONCURRENCY)
+
+# AudD HTTP client: one shared keep-alive connection pool for all chunks and requests
+AUDD_POOL_SIZE = int(os.environ.get('AUDD_POOL_SIZE', str(AUDD_MAX_CONCURRENCY)))
+AUDD_CONNECT_TIMEOUT = float(os.environ.get('AUDD_CONNECT_TIMEOUT', '5'))  # seconds
+AUDD_READ_TIMEOUT = float(os.environ.get('AUDD_READ_TIMEOUT', '30'))  # seconds
+AUDD_KEEPALIVE = os.environ.get('AUDD_KEEPALIVE', '1') != '0'
+AUDD_QUERY_COST = float(os.environ.get('AUDD_QUERY_COST', '0.005'))  # per query, for the backend stats
+
+# Recognition backends, tried in RECOGNITION_BACKENDS order ('local', 'audd', 'mock';
+# 'local' is the reference and learned fingerprint indexes, whose misses always
+# fall through). A backend whose response is an error is followed by the next
+# one, and with BACKEND_ESCALATE_MISSES a miss is too. A call still unanswered after HEDGE_AFTER
+# seconds (0 = never) is raced against the next backend. A backend failing
+# BACKEND_FAILURE_THRESHOLD times in a row is skipped for BACKEND_COOLDOWN seconds
+RECOGNITION_BACKENDS = [name.strip() for name in os.environ.get('RECOGNITION_BACKENDS', 'local,audd').split(',') if name.strip()]
+HEDGE_AFTER = float(os.environ.get('HEDGE_AFTER', '0'))  # seconds
+BACKEND_ESCALATE_MISSES = os.environ.get('BACKEND_ESCALATE_MISSES', '0') != '0'
+BACKEND_FAILURE_THRESHOLD = int(os.environ.get('BACKEND_FAILURE_THRESHOLD', '5'))
+BACKEND_COOLDOWN = float(os.environ.get('BACKEND_COOLDOWN', '30'))  # seconds
+
+# Offline mock backend: answers every chunk with MOCK_BACKEND_RESULT (an AudD
+# 'result' object as JSON; empty = no match) after MOCK_BACKEND_LATENCY seconds
+MOCK_BACKEND_RESULT = os.environ.get('MOCK_BACKEND_RESULT', '')
+MOCK_BACKEND_LATENCY = float(os.environ.get('MOCK_BACKEND_LATENCY', '0.5'))  # seconds
+MOCK_BACKEND_ERROR_RATE = float(os.environ.get('MOCK_BACKEND_ERROR_RATE', '0'))
+
+# Chunk pipeline: extraction workers each drive one ffmpeg encode at a time, and
+# bounded queues between the stages cap how many chunks are in flight
+EXTRACT_WORKERS = int(os.environ.get('EXTRACT_WORKERS', str(os.cpu_count() or 2)))
+EXTRACT_QUEUE_SIZE = int(os.environ.get('EXTRACT_QUEUE_SIZE', '8'))  # windows waiting to be encoded
+UPLOAD_QUEUE_SIZE = int(os.environ.get('UPLOAD_QUEUE_SIZE', '8'))  # encoded chunks waiting for AudD
+
+# Recognition cache: AudD responses keyed by the encoding profile and a hash of the
+# chunk's decoded PCM (or of the encoded chunk when no PCM window is available);
+# a chunk that AudD missed in one profile may still match in another
+RECOGNITION_CACHE_PATH = os.environ.get('RECOGNITION_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'soundscan-recognition.sqlite3'))
+RECOGNITION_CACHE_ENTRIES = int(os.environ.get('RECOGNITION_CACHE_ENTRIES', '4096'))  # in-memory LRU tier
+RECOGNITION_CACHE_MAX_MB = float(os.environ.get('RECOGNITION_CACHE_MAX_MB', '256'))  # on-disk tier
+RECOGNITION_CACHE_TTL = float(os.environ.get('RECOGNITION_CACHE_TTL', str(7 * 86400)))  # seconds
+recognition_cache = ResultCache(
+    RECOGNITION_CACHE_PATH or None,
+    memory_entries=RECOGNITION_CACHE_ENTRIES,
+    max_bytes=int(RECOGNITION_CACHE_MAX_MB * (1 << 20)),
+    ttl=RECOGNITION_CACHE_TTL
+)
+
+# Result cache: whole-upload results keyed by file digest and scan parameters
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'soundscan-results.sqlite3'))
+RESULT_CACHE_ENTRIES = int(os.environ.get('RESULT_CACHE_ENTRIES', '256'))  # in-memory LRU tier
+RESULT_CACHE_MAX_MB = float(os.environ.get('RESULT_CACHE_MAX_MB', '64'))  # on-disk tier
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', str(86400)))  # seconds
+result_cache = ResultCache(
+    RESULT_CACHE_PATH or None,
+    memory_entries=RESULT_CACHE_ENTRIES,
+    max_bytes=int(RESULT_CACHE_MAX_MB * (1 << 20)),
+    ttl=RESULT_CACHE_TTL
+)
+UPLOAD_BLOCK_SIZE = 1 << 20  # bytes read from the upload stream at a time
+
+# Uploads whose header declares a longer duration are refused before the rest is
+# received; 0 disables the check. Headers that need more than the first
+# UPLOAD_PROBE_SIZE bytes (MP4 with the index at the end, Ogg) aren't checked
+MAX_AUDIO_DURATION = float(os.environ.get('MAX_AUDIO_DURATION', str(6 * 3600)))  # seconds
+UPLOAD_PROBE_SIZE = 1 << 18  # bytes
+
+# Idle streaming responses get a heartbeat this often so proxies keep them open
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', '15'))  # seconds
+
+# Background jobs: uploads wait in JOB_UPLOAD_DIR and jobs in a SQLite table until
+# one of JOB_WORKERS threads runs them, so both survive a restart
+JOBS_PATH = os.environ.get('JOBS_PATH', os.path.join(tempfile.gettempdir(), 'soundscan-jobs.sqlite3'))
+JOB_UPLOAD_DIR = os.environ.get('JOB_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'soundscan-job-uploads'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_QUEUED = int(os.environ.get('JOB_MAX_QUEUED', '100'))  # submissions beyond this are refused
+JOB_TTL = float(os.environ.get('JOB_TTL', str(7 * 86400)))  # seconds finished jobs are kept
+# A running job whose process hasn't renewed its lease for JOB_LEASE seconds is
+# taken to be orphaned and requeued
+JOB_LEASE = float(os.environ.get('JOB_LEASE', '60'))
+
+# Extraction configuration
+# 'single_pass' decodes the upload once and slices every chunk from that decode,
+# 'pcm_buffer' decodes once into an mmap'd PCM file that chunks are sliced from,
+# 'per_chunk' runs one ffmpeg seek+decode per chunk (the original behaviour)
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'single_pass')
+SAMPLE_RATE = 44100  # Hz, mono signed 16-bit PCM between decode and encode
+PCM_BYTES_PER_SECOND = SAMPLE_RATE * 2
+PCM_READ_SIZE = 1 << 16  # bytes read from the decoder per pipe read
+PCM_STALL_TIMEOUT = float(os.environ.get('PCM_STALL_TIMEOUT', '60'))  # seconds without decoder output before giving up
+DECODER_ERROR_SIZE = 4096  # bytes of ffmpeg's error log kept for the exception
+
+# Encoding profiles for the chunks sent for recognition: ffmpeg codec and muxer,
+# chunk file extension, sample rate, bit rate (None for uncompressed PCM) and any
+# extra encoder options. 'mp3_128k' is the original format; the compressed others
+# send a fraction of the bytes
+ENCODING_PROFILES = {
+    'mp3_128k': {'codec': 'libmp3lame', 'format': 'mp3', 'extension': '.mp3', 'sample_rate': 44100, 'bit_rate': 128000},
+    'mp3_48k': {'codec': 'libmp3lame', 'format': 'mp3', 'extension': '.mp3', 'sample_rate': 22050, 'bit_rate': 48000},
+    'opus_24k': {'codec': 'libopus', 'format': 'ogg', 'extension': '.ogg', 'sample_rate': 16000, 'bit_rate': 24000,
+                 # libopus' default complexity (10) takes about 4x as long as an MP3 encode
+                 'options': ['-compression_level', '5']},
+    'wav_16k': {'codec': 'pcm_s16le', 'format': 'wav', 'extension': '.wav', 'sample_rate': 16000, 'bit_rate': None},
+}
+ENCODING_PROFILE = os.environ.get('ENCODING_PROFILE', 'mp3_128k')  # default, overridable per request
+
+# Decoder backend: 'auto' probes and decodes chunks in-process with PyAV when it is
+# installed and falls back to ffmpeg/ffprobe subprocesses otherwise; 'pyav' refuses
+# to start without PyAV and 'subprocess' always spawns them. The in-process pool
+# keeps recently used files open
+DECODER_BACKEND = os.environ.get('DECODER_BACKEND', 'auto')
+DECODER_WORKERS = int(os.environ.get('DECODER_WORKERS', str(EXTRACT_WORKERS)))
+DECODER_OPEN_FILES = int(os.environ.get('DECODER_OPEN_FILES', '4'))  # per worker
+if DECODER_BACKEND not in ('auto', 'pyav', 'subprocess'):
+    raise Exception(f"Unknown DECODER_BACKEND: {DECODER_BACKEND}")
+if DECODER_BACKEND == 'pyav' and not decoder.available():
+    raise Exception("DECODER_BACKEND is 'pyav' but PyAV (the av package) is not installed")
+decoder_pool = None
+if DECODER_BACKEND != 'subprocess' and decoder.available():
+    decoder_pool = decoder.DecoderPool(DECODER_WORKERS, open_files=DECODER_OPEN_FILES)
+
+# Analysis passes run on a separate low-rate decode of the upload
+ANALYSIS_SAMPLE_RATE = 8000  # Hz, mono signed 16-bit
+
+# Local fingerprint tier (the 'local' recognition backend): chunks are matched against
+# our own reference catalogue and only sent on to AudD when no reference matches
+# confidently, i.e. with at least FINGERPRINT_MIN_SCORE hashes agreeing on one offset
+# and FINGERPRINT_MIN_RATIO times the score of any other track
+FINGERPRINT_INDEX_PATH = os.environ.get('FINGERPRINT_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'soundscan-fingerprints.sqlite3'))
+FINGERPRINT_MIN_SCORE = int(os.environ.get('FINGERPRINT_MIN_SCORE', '20'))
+FINGERPRINT_MIN_RATIO = float(os.environ.get('FINGERPRINT_MIN_RATIO', '2'))
+fingerprint_index = FingerprintIndex(FINGERPRINT_INDEX_PATH or None, rate=ANALYSIS_SAMPLE_RATE)
+
+# Learned tier: chunks AudD recognizes are fingerprinted into a second index under
+# the song's identity, so later chunks of the same songs, in this upload or future
+# ones, are matched locally. It holds at most LEARNED_INDEX_MAX_TRACKS songs and
+# evicts the least used, counting hits that decay with LEARNED_INDEX_HALF_LIFE. It
+# lives in memory unless LEARNED_INDEX_PATH is set.
+LEARN_FROM_AUDD = os.environ.get('LEARN_FROM_AUDD', '1') != '0'
+LEARNED_INDEX_PATH = os.environ.get('LEARNED_INDEX_PATH', '')
+LEARNED_INDEX_MAX_TRACKS = int(os.environ.get('LEARNED_INDEX_MAX_TRACKS', '1000'))
+LEARNED_INDEX_HALF_LIFE = float(os.environ.get('LEARNED_INDEX_HALF_LIFE', str(7 * 86400)))  # seconds
+learned_index = FingerprintIndex(LEARNED_INDEX_PATH or None, rate=ANALYSIS_SAMPLE_RATE,
+                                 max_tracks=LEARNED_INDEX_MAX_TRACKS, half_life=LEARNED_INDEX_HALF_LIFE)
+
+# Known-segment library: recurring segments (show intros, ad beds, library cues)
+# registered through /api/admin/segments are matched against every upload before
+# any chunk is sent. They are listed in songs with their 'cleared' or 'known'
+# status, and chunks at least KNOWN_SEGMENT_MIN_COVER inside one are not sent.
+# The admin endpoints need ADMIN_TOKEN in an X-Admin-Token header and are off
+# without it.
+SEGMENT_INDEX_PATH = os.environ.get('SEGMENT_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'soundscan-segments.sqlite3'))
+SEGMENT_STATUSES = ('cleared', 'known')
+KNOWN_SEGMENT_MIN_COVER = float(os.environ.get('KNOWN_SEGMENT_MIN_COVER', '0.75'))
+MAX_SEGMENT_DURATION = float(os.environ.get('MAX_SEGMENT_DURATION', '600'))  # seconds
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+segment_index = FingerprintIndex(SEGMENT_INDEX_PATH or None, rate=ANALYSIS_SAMPLE_RATE)
+
+# Silence skipping: chunks whose loudest half second is below the floor are never sent
+SKIP_SILENCE = os.environ.get('SKIP_SILENCE', '1') != '0'
+SILENCE_FLOOR_DB = float(os.environ.get('SILENCE_FLOOR_DB', '-50'))  # dBFS
+
+# Speech gate: chunks whose music score is below MUSIC_THRESHOLD look like pure
+# speech and are 'skip'ped, 'defer'red until every other chunk is sent, or 'off'.
+# Deferring only saves calls when a deadline can cut the scan short, so without
+# one 'defer' sends every chunk in order
+SPEECH_GATE = os.environ.get('SPEECH_GATE', 'defer')
+MUSIC_THRESHOLD = float(os.environ.get('MUSIC_THRESHOLD', '0.2'))
+
+# Repeat detection: chunks whose chroma sequence repeats an earlier chunk's (jingles,
+# stingers, a returning music bed) with at least REPEAT_SIMILARITY correlation are
+# not sent; they take the result of the first chunk of their cluster
+SKIP_REPEATS = os.environ.get('SKIP_REPEATS', '1') != '0'
+REPEAT_SIMILARITY = float(os.environ.get('REPEAT_SIMILARITY', '0.8'))
+
+# Skip-ahead: after a match, chunks inside the rest of the song (predicted from the
+# AudD timecode and track length) are only sampled every SKIP_AHEAD_SAMPLE_INTERVAL
+# seconds, and dense scanning resumes SKIP_AHEAD_MARGIN seconds before its end
+SKIP_AHEAD = os.environ.get('SKIP_AHEAD', '1') != '0'
+SKIP_AHEAD_SAMPLE_INTERVAL = float(os.environ.get('SKIP_AHEAD_SAMPLE_INTERVAL', '60'))
+SKIP_AHEAD_MARGIN = float(os.environ.get('SKIP_AHEAD_MARGIN', '15'))
+
+# Scan strategy: 'dense' queries every overlapping chunk, 'coarse' probes every
+# COARSE_STRIDE seconds and bisects between disagreeing probes down to REFINE_PRECISION
+SCAN_STRATEGY = os.environ.get('SCAN_STRATEGY', 'dense')
+COARSE_STRIDE = float(os.environ.get('COARSE_STRIDE', '45'))  # seconds
+REFINE_PRECISION = float(os.environ.get('REFINE_PRECISION', '4'))  # seconds
+
+# Query budget: cap on AudD calls per file (0 = no cap); a per-request max_queries
+# lowers it. Budgeted scans pick chunks by priority instead of scanning in order
+MAX_QUERIES = int(os.environ.get('MAX_QUERIES', '0'))
+BUDGET_HORIZON = float(os.environ.get('BUDGET_HORIZON', '60'))  # seconds from a queried chunk to count as uncovered
+
+# Default time limit for /api/analyze in milliseconds (0 = none); a per-request
+# deadline_ms overrides it. Time spent receiving the upload counts against it
+ANALYZE_DEADLINE_MS = float(os.environ.get('ANALYZE_DEADLINE_MS', '0'))
+
+# Per-chunk extraction seeks on the input (-ss before -i) unless disabled; a chunk
+# whose extracted length is off by more than SEEK_TOLERANCE is re-extracted slowly
+FAST_SEEK = os.environ.get('FAST_SEEK', '1') != '0'
+SEEK_TOLERANCE = float(os.environ.get('SEEK_TOLERANCE', '0.25'))  # seconds
+# Only these containers are seeked on the input: MP3 (VBR without a TOC), ADTS AAC
+# and WMA seeks are estimated from the bit rate and can land seconds off while the
+# length still comes out right, so those are always seeked on the output
+EXACT_SEEK_EXTENSIONS = {'.wav', '.flac', '.ogg', '.m4a', '.mp4', '.webm'}
+
+
+def deadline_passed(deadline: float) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def release_upload(audio_path: str):
+    """Close the decoder pool's containers on an upload that is about to be deleted."""
+    if decoder_pool is not None:
+        decoder_pool.release(audio_path)
+
+
+def get_audio_duration(audio_path: str, in_process: bool = None) -> float:
+    """Get duration of audio file.
+    
+    The header prober in probe.py answers for most WAV, FLAC, MP3, MP4 and
+    Ogg files. Anything it can't vouch for is opened by the in-process
+    decoder (the default when decoder_pool is set) or else by ffprobe.
+    """
+    duration = probe.file_duration(audio_path)
+    if duration is not None:
+        return duration
+    
+    if decoder_pool is not None and in_process is not False:
+        try:
+            return decoder_pool.duration(audio_path)
+        except Exception:
+            pass
+    
+    return ffprobe_duration(audio_path)
+
 
-def get_audio_duration(audio_path: str) -> float:
+def ffprobe_duration(audio_path: str) -> float:
     """Get duration of audio file using ffprobe."""
     cmd = [
         'ffprobe',
@@ -41,67 +301,768 @@ def get_audio_duration(audio_path: str) -> float:
     return float(data['format']['duration'])
 
 
-def extract_audio_chunk(audio_path: str, start_time: float, duration: float, output_path: str):
-    """Extract a chunk of audio using ffmpeg."""
+def parse_progress_duration(progress: str) -> float:
+    """Return the output length from ffmpeg -progress output, or None if absent."""
+    duration = None
+    for line in progress.splitlines():
+        key, _, value = line.partition('=')
+        if key == 'out_time_us' and value.strip().lstrip('-').isdigit():
+            duration = int(value) / 1_000_000
+    return duration
+
+
+def encoder_args(encoding_profile: str = None) -> list:
+    """ffmpeg output options for a chunk in the named profile (ENCODING_PROFILE by default)."""
+    profile = ENCODING_PROFILES[encoding_profile or ENCODING_PROFILE]
+    return [
+        '-acodec', profile['codec'],
+        '-ar', str(profile['sample_rate']),
+        '-ac', '1',
+        *(['-b:a', str(profile['bit_rate'])] if profile['bit_rate'] else []),
+        *profile.get('options', []),
+        '-f', profile['format']
+    ]
+
+
+def extract_audio_chunk(audio_path: str, start_time: float, duration: float, output_path: str, fast_seek: bool = None,
+                        deadline: float = None, in_process: bool = None, encoding_profile: str = None):
+    """Extract a chunk of audio using ffmpeg, encoded with `encoding_profile`.
+    
+    With fast seeking, -ss goes before -i so ffmpeg seeks in the demuxer instead
+    of decoding and discarding everything before start_time. That is only done
+    for EXACT_SEEK_EXTENSIONS; the length of the extracted chunk is checked
+    against SEEK_TOLERANCE and the chunk is extracted again with output seeking
+    if the fast seek came up short. ffmpeg is killed if it is still running at
+    `deadline`.
+    
+    With the in-process decoder the window is decoded from a container kept
+    open by decoder_pool (seeking there is always on the input, so it is only
+    used for EXACT_SEEK_EXTENSIONS) and only the encode runs in ffmpeg; the
+    whole extraction falls back to ffmpeg if that fails.
+    """
+    exact_seek = os.path.splitext(audio_path)[1].lower() in EXACT_SEEK_EXTENSIONS
+    if decoder_pool is not None and in_process is not False and exact_seek:
+        try:
+            pcm = decoder_pool.window(audio_path, start_time, duration, SAMPLE_RATE, timeout=time_left(deadline, 60))
+            encode_pcm_chunk(pcm, output_path, deadline=deadline, encoding_profile=encoding_profile)
+            return
+        except Exception:
+            pass
+    
+    if fast_seek is None:
+        fast_seek = FAST_SEEK and exact_seek
+    
+    seek = ['-ss', str(start_time)]
     cmd = [
         'ffmpeg',
         '-y',
+        *(seek if fast_seek else []),
         '-i', audio_path,
-        '-ss', str(start_time),
+        *([] if fast_seek else seek),
         '-t', str(duration),
-        '-acodec', 'libmp3lame',
-        '-ar', '44100',
-        '-ac', '1',
-        '-b:a', '128k',
+        *encoder_args(encoding_profile),
+        '-progress', 'pipe:1',
+        '-nostats',
         output_path
     ]
     
-    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=time_left(deadline, 60))
     if result.returncode != 0:
         raise Exception(f"ffmpeg failed: {result.stderr}")
+    
+    if fast_seek:
+        extracted = parse_progress_duration(result.stdout)
+        if extracted is None or abs(extracted - duration) > SEEK_TOLERANCE:
+            extract_audio_chunk(audio_path, start_time, duration, output_path, fast_seek=False, deadline=deadline,
+                                in_process=False, encoding_profile=encoding_profile)
 
 
-def recognize_with_audd(audio_path: str) -> dict:
-    """Recognize music using AudD API."""
-    if not AUDD_API_TOKEN:
-        return {'error': 'AudD API token not configured'}
+def decode_pcm_stream(audio_path: str, stdin=None) -> subprocess.Popen:
+    """Start an ffmpeg process that decodes the whole file to raw PCM on stdout.
     
-    with open(audio_path, 'rb') as f:
-        data = {
-            'api_token': AUDD_API_TOKEN,
-            'return': 'timecode,spotify'
-        }
-        files = {'file': f}
+    Pass 'pipe:0' and stdin=subprocess.PIPE to feed the input through stdin.
+    stderr goes to a temporary file (proc.error_log) rather than a pipe, so a
+    damaged input that makes ffmpeg log a lot can't block it; read stdout
+    with read_pcm and the log with decoder_errors.
+    """
+    cmd = [
+        'ffmpeg',
+        '-nostdin',
+        '-v', 'error',
+        '-i', audio_path,
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        'pipe:1'
+    ]
+    
+    error_log = tempfile.TemporaryFile()
+    try:
+        proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=error_log, bufsize=0)
+    except Exception:
+        error_log.close()
+        raise
+    proc.error_log = error_log
+    return proc
+
+
+def read_pcm(proc: subprocess.Popen, deadline: float = None) -> bytes:
+    """Read the next block of a decode_pcm_stream process's output; b'' at the end.
+    
+    Raises if nothing arrives within PCM_STALL_TIMEOUT seconds or before
+    `deadline`.
+    """
+    ready, _, _ = select.select([proc.stdout], [], [], time_left(deadline, PCM_STALL_TIMEOUT))
+    if not ready:
+        raise Exception("deadline exceeded" if deadline_passed(deadline) else "ffmpeg stalled")
+    return proc.stdout.read(PCM_READ_SIZE)
+
+
+def decoder_errors(proc: subprocess.Popen) -> str:
+    """The start of a decode_pcm_stream process's error log."""
+    proc.error_log.seek(0)
+    return proc.error_log.read(DECODER_ERROR_SIZE).decode(errors='replace')
+
+
+def stop_decoder(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.kill()
+        proc.wait()
+    proc.error_log.close()
+
+
+def iter_pcm_windows(audio_path: str, chunks: list, deadline: float = None):
+    """Decode the file once and yield (index, start_time, duration, pcm) for each chunk.
+    
+    Chunks must be sorted by start time. Only the samples still needed by the
+    current and later windows are kept in memory, so overlapping windows are
+    sliced from the same decode instead of being decoded again. The decoder is
+    stopped once `deadline` passes, or after the last chunk's window.
+    """
+    proc = decode_pcm_stream(audio_path)
+    buffer = bytearray()
+    buffer_offset = 0  # byte position of buffer[0] in the decoded stream
+    eof = False
+    
+    try:
+        for i, (start_time, chunk_duration) in enumerate(chunks):
+            start = int(start_time * SAMPLE_RATE) * 2
+            end = start + int(chunk_duration * SAMPLE_RATE) * 2
+            
+            # Drop samples that no remaining window needs
+            if start > buffer_offset:
+                drop = min(start - buffer_offset, len(buffer))
+                del buffer[:drop]
+                buffer_offset += drop
+            
+            while not eof and buffer_offset + len(buffer) < end:
+                if deadline_passed(deadline):
+                    raise Exception("deadline exceeded")
+                data = read_pcm(proc, deadline)
+                if not data:
+                    eof = True
+                    break
+                
+                buffer.extend(data)
+                if start > buffer_offset:
+                    drop = min(start - buffer_offset, len(buffer))
+                    del buffer[:drop]
+                    buffer_offset += drop
+            
+            yield i, start_time, chunk_duration, bytes(buffer[start - buffer_offset:end - buffer_offset])
+        
+        # Chunks that end before the file does leave ffmpeg to be stopped, not waited for
+        if eof:
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise Exception(f"ffmpeg failed: {decoder_errors(proc)}")
+    
+    finally:
+        stop_decoder(proc)
+
+
+def decode_pcm_file(audio_path: str, pcm_path: str, deadline: float = None):
+    """Decode the whole file once to a raw PCM file."""
+    cmd = [
+        'ffmpeg',
+        '-y',
+        '-nostdin',
+        '-v', 'error',
+        '-i', audio_path,
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        pcm_path
+    ]
+    
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=time_left(deadline))
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg failed: {result.stderr}")
+
+
+class PCMBuffer:
+    """A decoded upload held as an mmap'd mono PCM file.
+    
+    Windows are zero-copy memoryview slices of the mapping, so any number of
+    chunk layouts can be cut from one decode.
+    """
+    
+    def __init__(self, audio_path: str, work_dir: str, deadline: float = None):
+        self.path = os.path.join(work_dir, 'decoded.pcm')
+        decode_pcm_file(audio_path, self.path, deadline)
+        
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if size else memoryview(b'')
+        self.duration = size / PCM_BYTES_PER_SECOND
+    
+    def window(self, start_time: float, duration: float) -> memoryview:
+        """Return the PCM samples for [start_time, start_time + duration)."""
+        start = int(start_time * SAMPLE_RATE) * 2
+        end = start + int(duration * SAMPLE_RATE) * 2
+        return self._view[start:end]
+    
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # A caller still holds a window; the mapping goes away with it
+                pass
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def encode_pcm_chunk(pcm: bytes, output_path: str, deadline: float = None, encoding_profile: str = None):
+    """Encode a raw PCM window to the chunk format sent for recognition."""
+    if not pcm:
+        raise Exception("no audio decoded for chunk")
+    
+    cmd = [
+        'ffmpeg',
+        '-y',
+        '-f', 's16le',
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '1',
+        '-i', 'pipe:0',
+        *encoder_args(encoding_profile),
+        output_path
+    ]
+    
+    result = subprocess.run(cmd, input=pcm, capture_output=True, timeout=time_left(deadline, 60))
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg failed: {result.stderr.decode(errors='replace')}")
+
+
+def silence_skip(level: float) -> dict:
+    """Skip details for a chunk whose loudest frame is `level` dBFS."""
+    return {'reason': 'silence', 'level_db': round(max(float(level), -120.0), 1)}
+
+
+def decode_analysis_audio(audio_path: str, duration: float = None, deadline: float = None) -> np.ndarray:
+    """Decode (the first `duration` seconds of) a file to low-rate mono int16 samples."""
+    cmd = [
+        'ffmpeg',
+        '-nostdin',
+        '-v', 'error',
+        '-i', audio_path,
+        *(['-t', str(duration)] if duration else []),
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ar', str(ANALYSIS_SAMPLE_RATE),
+        '-ac', '1',
+        'pipe:1'
+    ]
+    
+    result = subprocess.run(cmd, capture_output=True, timeout=time_left(deadline))
+    if result.returncode != 0:
+        raise Exception(f"ffmpeg failed: {result.stderr.decode(errors='replace')}")
+    
+    return np.frombuffer(result.stdout, dtype=np.int16)
+
+
+class LiveUpload:
+    """An upload that is decoded and cut into chunks while it is still arriving.
+    
+    A feeder thread copies the request stream into ffmpeg's stdin and into a
+    spool file. windows() plans chunks on the PCM that
+    has been decoded so far, so recognition of the start of the file overlaps
+    with the upload of the rest. Containers that need their index from the
+    end of the file (MP4/M4A) cannot be decoded this way.
+    """
+    
+    def __init__(self, stream, spool_path: str, max_duration: float = None):
+        self.stream = stream
+        self.spool_path = spool_path
+        self.max_duration = max_duration
+        self.decoded_bytes = 0
+        self.feed_error = None
+        self.proc = decode_pcm_stream('pipe:0', stdin=subprocess.PIPE)
+        self.feeder = threading.Thread(target=self.feed, daemon=True)
+        self.feeder.start()
+    
+    def feed(self):
+        try:
+            with open(self.spool_path, 'wb') as spool:
+                while True:
+                    block = self.stream.read(UPLOAD_BLOCK_SIZE)
+                    if not block:
+                        break
+                    spool.write(block)
+                    try:
+                        self.proc.stdin.write(block)
+                    except (BrokenPipeError, ValueError):
+                        # ffmpeg gave up; keep receiving so the spool is whole
+                        pass
+        except Exception as e:
+            self.feed_error = e
+        finally:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+    
+    def read(self, deadline: float = None) -> bytes:
+        data = read_pcm(self.proc, deadline)
+        self.decoded_bytes += len(data)
+        return data
+    
+    def windows(self, chunks: list, skip: dict = None, silence_floor_db: float = None, deadline: float = None):
+        """Yield (index, start_time, duration, extract, digest) as the decoded audio covers each chunk.
         
-        response = requests.post(
-            'https://api.audd.io/',
-            data=data,
-            files=files,
-            timeout=30
-        )
+        Chunks follow the plan_chunks layout and are appended to `chunks` as they
+        are planned. With SKIP_SILENCE, chunks whose loudest frame is under the
+        floor are added to `skip` before they are yielded.
+        """
+        floor = SILENCE_FLOOR_DB if silence_floor_db is None else silence_floor_db
+        window_bytes = int(CHUNK_DURATION * SAMPLE_RATE) * 2
+        buffer = bytearray()
+        buffer_offset = 0  # byte position of buffer[0] in the decoded stream
+        eof = False
+        start_time = 0
+        
+        while self.max_duration is None or start_time < self.max_duration:
+            start = int(start_time * SAMPLE_RATE) * 2
+            
+            # Drop samples that no remaining window needs
+            if start > buffer_offset:
+                drop = min(start - buffer_offset, len(buffer))
+                del buffer[:drop]
+                buffer_offset += drop
+            
+            while not eof and buffer_offset + len(buffer) < start + window_bytes:
+                if deadline_passed(deadline):
+                    raise Exception("deadline exceeded")
+                data = self.read(deadline)
+                if not data:
+                    eof = True
+                    break
+                buffer.extend(data)
+            
+            pcm = bytes(buffer[start - buffer_offset:start - buffer_offset + window_bytes])
+            if self.max_duration is not None:
+                pcm = pcm[:int((self.max_duration - start_time) * SAMPLE_RATE) * 2]
+            if not pcm:
+                break
+            
+            i = len(chunks)
+            chunk_duration = len(pcm) / PCM_BYTES_PER_SECOND
+            chunks.append((start_time, chunk_duration))
+            if SKIP_SILENCE and skip is not None:
+                level = chunk_peak_levels(np.frombuffer(pcm, dtype=np.int16), SAMPLE_RATE, [(0, chunk_duration)])[0]
+                if level < floor:
+                    skip[i] = silence_skip(level)
+            
+            yield i, start_time, chunk_duration, partial(encode_pcm_chunk, pcm), audio_digest('pcm', pcm)
+            start_time += CHUNK_DURATION - OVERLAP
+    
+    def finish(self) -> float:
+        """Wait for the rest of the upload and return the decoded duration in seconds."""
+        while self.read():
+            pass
+        self.feeder.join()
+        if self.proc.wait() != 0:
+            raise Exception(f"ffmpeg failed: {decoder_errors(self.proc)}")
+        if self.feed_error is not None:
+            raise Exception(f"upload failed: {self.feed_error}")
+        return self.decoded_bytes / PCM_BYTES_PER_SECOND
+    
+    def close(self):
+        stop_decoder(self.proc)
+        self.feeder.join()
+
+
+def plan_chunks(analyze_duration: float) -> list:
+    """Plan overlapping (start_time, duration) chunks covering the analyzed span."""
+    chunks = []
+    current_time = 0
+    while current_time < analyze_duration:
+        chunk_end = min(current_time + CHUNK_DURATION, analyze_duration)
+        chunks.append((current_time, chunk_end - current_time))
+        current_time += CHUNK_DURATION - OVERLAP
+    
+    return chunks
+
+
+def chunk_waves(count: int) -> dict:
+    """Coarse-to-fine dispatch waves for `count` planned chunks: {chunk index: wave}.
+    
+    Wave 0 is one chunk about every COARSE_STRIDE seconds, and each later wave
+    adds the chunks halfway between those already in earlier waves, so work
+    cut short by a deadline leaves gaps spread over the file rather than its
+    whole end unscanned.
+    """
+    stride = 2 ** int(np.log2(max(1.0, COARSE_STRIDE / (CHUNK_DURATION - OVERLAP))))
+    waves = {}
+    for i in range(count):
+        step, wave = stride, 0
+        while i % step:
+            step //= 2
+            wave += 1
+        waves[i] = wave
+    return waves
+
+
+def audio_digest(kind: str, data) -> str:
+    """Content address for chunk audio, e.g. audio_digest('pcm', window)."""
+    return f"{kind}:{hashlib.sha256(data).hexdigest()}"
+
+
+def iter_chunk_extractors(audio_path: str, chunks: list, work_dir: str, mode: str = None, pcm_buffer: PCMBuffer = None,
+                          deadline: float = None):
+    """Yield (index, start_time, duration, extract, digest) for each chunk.
+    
+    extract(output_path, deadline=None) writes the encoded chunk. digest addresses the decoded
+    PCM window when one is available before encoding, otherwise it is None.
+    `mode` overrides EXTRACTION_MODE, and an open `pcm_buffer` is sliced
+    directly so several chunk layouts can share one decode.
+    """
+    mode = mode or EXTRACTION_MODE
+    
+    if pcm_buffer is not None:
+        for i, (start_time, chunk_duration) in enumerate(chunks):
+            pcm = pcm_buffer.window(start_time, chunk_duration)
+            yield i, start_time, chunk_duration, partial(encode_pcm_chunk, pcm), audio_digest('pcm', pcm)
+        return
+    
+    if mode == 'per_chunk':
+        for i, (start_time, chunk_duration) in enumerate(chunks):
+            yield i, start_time, chunk_duration, partial(extract_audio_chunk, audio_path, start_time, chunk_duration), None
+        return
+    
+    if mode == 'pcm_buffer':
+        with PCMBuffer(audio_path, work_dir, deadline) as pcm_buffer:
+            yield from iter_chunk_extractors(audio_path, chunks, work_dir, pcm_buffer=pcm_buffer)
+        return
+    
+    for i, start_time, chunk_duration, pcm in iter_pcm_windows(audio_path, chunks, deadline):
+        yield i, start_time, chunk_duration, partial(encode_pcm_chunk, pcm), audio_digest('pcm', pcm)
+
+
+audd_session = None
+audd_session_lock = threading.Lock()
+
+
+def get_audd_session() -> requests.Session:
+    """Return the shared AudD session, creating its connection pool on first use."""
+    global audd_session
+    
+    with audd_session_lock:
+        if audd_session is None:
+            session = requests.Session()
+            # Connections are reused across chunks; only failed connects are retried
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AUDD_POOL_SIZE, pool_block=True, max_retries=1)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            if not AUDD_KEEPALIVE:
+                session.headers['Connection'] = 'close'
+            audd_session = session
+    
+    return audd_session
+
+
+audd_backend = AudDBackend(AUDD_API_TOKEN, AUDD_API_URL, get_audd_session, AUDD_SLOTS,
+                           AUDD_CONNECT_TIMEOUT, AUDD_READ_TIMEOUT, cost=AUDD_QUERY_COST)
+mock_backend = MockBackend.from_json(MOCK_BACKEND_RESULT, latency=MOCK_BACKEND_LATENCY,
+                                     error_rate=MOCK_BACKEND_ERROR_RATE)
+
+
+def recognize_with_audd(audio_path: str, deadline: float = None) -> dict:
+    """Recognize music using AudD API, bypassing the router."""
+    return audd_backend.recognize(audio_path, deadline)
+
+
+def confident(match: dict) -> bool:
+    """Whether a fingerprint match clears FINGERPRINT_MIN_SCORE and FINGERPRINT_MIN_RATIO."""
+    return match is not None and match['score'] >= max(FINGERPRINT_MIN_SCORE, FINGERPRINT_MIN_RATIO * match['runner_up'])
+
+
+def recognize_locally(audio_path: str, deadline: float = None, samples: np.ndarray = None, exclude=()) -> dict:
+    """Match a chunk against the reference index, then the learned index.
+    
+    Returns a response shaped like AudD's, with 'backend': 'local' and the
+    'index' that matched, when a track matches confidently, and None otherwise
+    (also when the chunk can't be decoded) so the router goes on to the next
+    backend. This is the 'local' backend's matcher.
+    `samples` are the chunk's analysis samples, if already decoded. Learned
+    tracks in `exclude` don't count as matches.
+    """
+    indexes = [(name, index) for name, index in (('reference', fingerprint_index), ('learned', learned_index)) if len(index)]
+    if not indexes:
+        return None
+    
+    if samples is None:
+        try:
+            samples = decode_analysis_audio(audio_path, deadline=deadline)
+        except Exception:
+            return None
     
-    return response.json()
+    for name, index in indexes:
+        match = index.match(samples)
+        if not confident(match) or index is learned_index and match['track_id'] in exclude:
+            continue
+        index.hit(match['track_id'])
+        
+        metadata = match['metadata']
+        return {
+            'status': 'success',
+            'backend': 'local',
+            'index': name,
+            'score': match['score'],
+            'result': {
+                'title': metadata.get('title', 'Unknown'),
+                'artist': metadata.get('artist', 'Unknown'),
+                'album': metadata.get('album', 'Unknown'),
+                'release_date': metadata.get('release_date', 'Unknown'),
+                'label': metadata.get('label', 'Unknown'),
+                'timecode': format_timestamp(max(0.0, match['offset'])),
+                'duration': metadata.get('duration', 0),
+                'spotify': {}
+            }
+        }
+    return None
 
 
-def parse_audd_result(result: dict) -> dict:
-    """Parse AudD API response."""
-    if result.get('status') != 'success' or not result.get('result'):
+local_backend = LocalBackend(recognize_locally)
+recognition_backends = {backend.name: backend for backend in (local_backend, audd_backend, mock_backend)}
+recognition_router = Router([recognition_backends[name] for name in RECOGNITION_BACKENDS],
+                            hedge_after=HEDGE_AFTER or None, escalate_misses=BACKEND_ESCALATE_MISSES,
+                            failure_threshold=BACKEND_FAILURE_THRESHOLD, cooldown=BACKEND_COOLDOWN)
+
+
+def learn_from_audd(audio_path: str, result: dict, samples: np.ndarray = None) -> int:
+    """Add a chunk AudD recognized to the learned index; returns the track id, or None.
+    
+    Chunks of one song share a track, keyed by song_key and aligned by the
+    AudD timecode, so the song's coverage grows with every new excerpt.
+    """
+    parsed = recognition_router.parse(result)
+    if parsed is None:
         return None
     
     track = result['result']
+    metadata = {field: track.get(field, 'Unknown') for field in ('title', 'artist', 'album', 'release_date', 'label')}
+    metadata['duration'] = parsed['duration']
+    try:
+        if samples is None:
+            samples = decode_analysis_audio(audio_path)
+        return learned_index.add(samples, metadata, key=song_key(parsed),
+                                 offset=parse_timecode(parsed['timecode']) or 0.0)
+    except Exception:
+        return None
+
+
+def recognize_chunk(audio_path: str, deadline: float = None, span: tuple = None, learned: dict = None,
+                    samples: np.ndarray = None) -> dict:
+    """Recognize a chunk through the router, local indexes included, learning what AudD finds.
+    
+    `learned` maps learned track ids to the (start, end) spans of this upload
+    they were learned from, and is added to. A chunk whose `span` overlaps one
+    of those isn't matched against that track, since the overlapping audio
+    would match it whatever the rest of the chunk holds. `samples` are the
+    chunk's analysis samples, if already decoded.
+    """
+    learned = {} if learned is None else learned
+    exclude = set()
+    if span is not None:
+        exclude = {track_id for track_id, spans in learned.items()
+                   if any(start < span[1] and span[0] < end for start, end in spans)}
+    if samples is not None and not len(samples):
+        samples = None
+    if samples is None and 'local' in recognition_router.by_name and (len(fingerprint_index) or len(learned_index)):
+        try:
+            samples = decode_analysis_audio(audio_path, deadline=deadline)
+        except Exception:
+            pass
+    
+    result = recognition_router.recognize(audio_path, deadline=deadline, samples=samples, exclude=exclude)
+    if LEARN_FROM_AUDD and recognition_router.authoritative(result):
+        track_id = learn_from_audd(audio_path, result, samples)
+        if track_id is not None and span is not None:
+            learned.setdefault(track_id, []).append(span)
+    return result
+
+
+def index_reference(audio_path: str, metadata: dict) -> int:
+    """Add a reference recording (title, artist, ... in `metadata`) to the local fingerprint index."""
+    return fingerprint_index.add(decode_analysis_audio(audio_path), metadata)
+
+
+def segment_result(segment_id: int, metadata: dict) -> dict:
+    """A library segment shaped like parse_audd_result's output, plus its status."""
     return {
-        'title': track.get('title', 'Unknown'),
-        'artists': [track.get('artist', 'Unknown')],
-        'album': track.get('album', 'Unknown'),
-        'release_date': track.get('release_date', 'Unknown'),
-        'label': track.get('label', 'Unknown'),
-        'duration': 0,
+        'title': metadata.get('title', 'Unknown'),
+        'artists': [metadata.get('artist', 'Unknown')],
+        'album': metadata.get('album', 'Unknown'),
+        'release_date': 'Unknown',
+        'label': metadata.get('label', 'Unknown'),
+        'duration': metadata.get('duration', 0),
         'confidence': 100,
-        'spotify': track.get('spotify', {}),
-        'timecode': track.get('timecode', '')
+        'spotify': {},
+        'timecode': '',
+        'status': metadata.get('status', 'known'),
+        'source': 'segment_library',
+        'segment_id': segment_id
     }
 
 
+def find_known_segments(samples: np.ndarray) -> list:
+    """Occurrences of library segments in an upload's analysis samples.
+    
+    Windows of CHUNK_DURATION seconds, half a chunk apart, are matched with
+    the same confidence rule as recognize_locally. Only the audio that
+    matched is credited: in each window, the stretch between the first and
+    last hashes that agree on the window's offset, inside where that offset
+    places the segment. So an upload that leaves a segment early is not
+    cleared past the last match.
+    Returns (start_time, end_time, parsed) with overlapping spans of a
+    segment merged, in time order.
+    """
+    if not len(segment_index):
+        return []
+    
+    end_of_audio = len(samples) / ANALYSIS_SAMPLE_RATE
+    spans = {}  # segment id -> [[start, end], ...]
+    parsed = {}
+    for window_start, match in segment_index.scan(samples, CHUNK_DURATION, CHUNK_DURATION / 2):
+        if not confident(match):
+            continue
+        segment_index.hit(match['track_id'])
+        parsed[match['track_id']] = segment_result(match['track_id'], match['metadata'])
+        origin = window_start - match['offset']
+        duration = match['metadata'].get('duration') or CHUNK_DURATION
+        matched_from, matched_to = match['matched']
+        start = max(window_start + matched_from, origin)
+        end = min(window_start + matched_to, origin + duration, end_of_audio)
+        if end > start:
+            spans.setdefault(match['track_id'], []).append([start, end])
+    
+    segments = []
+    for segment_id, ranges in spans.items():
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        segments += [(start, end, parsed[segment_id]) for start, end in merged]
+    return sorted(segments, key=lambda segment: segment[0])
+
+
+def known_segment_skips(chunks: list, segments: list) -> dict:
+    """Skip details for the chunks at least KNOWN_SEGMENT_MIN_COVER inside a known segment."""
+    skipped = {}
+    for i, (start_time, chunk_duration) in enumerate(chunks):
+        for start, end, parsed in segments:
+            covered = min(end, start_time + chunk_duration) - max(start, start_time)
+            if chunk_duration > 0 and covered >= KNOWN_SEGMENT_MIN_COVER * chunk_duration:
+                skipped[i] = {'reason': 'known_segment', 'segment_id': parsed['segment_id'],
+                              'title': parsed['title'], 'status': parsed['status']}
+                break
+    return skipped
+
+
+def parse_timecode(timecode: str) -> float:
+    """Parse an AudD MM:SS or HH:MM:SS timecode to seconds, or None."""
+    try:
+        seconds = 0.0
+        for part in timecode.split(':'):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    except (AttributeError, ValueError):
+        return None
+
+
+def song_key(parsed: dict) -> str:
+    """Identity used to group detections of the same song."""
+    return f"{parsed['title']}|{'|'.join(parsed['artists'])}"
+
+
+class SkipAhead:
+    """Predicts where matched songs end so the chunks inside them can be skipped.
+    
+    A match carries the AudD timecode (the offset within the song) and the
+    track length, which place the song's end on the upload timeline. Chunks
+    that lie entirely between the matched chunk and SKIP_AHEAD_MARGIN before
+    that end are skipped, except one sample every SKIP_AHEAD_SAMPLE_INTERVAL
+    seconds and the last chunk before that end, which confirm the song is
+    still playing.
+    """
+    
+    def __init__(self, chunks: list):
+        self.chunks = chunks
+        self.spans = []
+        self.decisions = {}  # chunk index -> song key it is skipped for, or None if sampled
+        self.lock = threading.Lock()
+    
+    def add(self, i: int, parsed: dict):
+        """Record a match on chunk i."""
+        offset = parse_timecode(parsed.get('timecode'))
+        if offset is None or not parsed.get('duration'):
+            return
+        
+        start_time = self.chunks[i][0]
+        song_end = start_time - offset + parsed['duration']
+        with self.lock:
+            self.spans.append({
+                'song': song_key(parsed),
+                'after': start_time,
+                'until': song_end - SKIP_AHEAD_MARGIN,
+                'last_sample': start_time
+            })
+    
+    def skip(self, i: int) -> str:
+        """Return the song chunk i should be skipped for, or None to scan it."""
+        with self.lock:
+            if i in self.decisions:
+                return self.decisions[i]
+            
+            start_time, chunk_duration = self.chunks[i]
+            for span in self.spans:
+                if span['after'] < start_time and start_time + chunk_duration <= span['until']:
+                    last = start_time + CHUNK_DURATION - OVERLAP + chunk_duration > span['until']
+                    if last or start_time - span['last_sample'] >= SKIP_AHEAD_SAMPLE_INTERVAL:
+                        span['last_sample'] = start_time
+                        self.decisions[i] = None
+                    else:
+                        self.decisions[i] = span['song']
+                    return self.decisions[i]
+            
+            # No prediction covers the chunk yet; a later match may still
+            return None
+
+
 def format_timestamp(seconds: float) -> str:
     """Format seconds to MM:SS or HH:MM:SS."""
     hours = int(seconds // 3600)
@@ -113,7 +1074,651 @@ def format_timestamp(seconds: float) -> str:
     return f"{minutes:02d}:{secs:02d}"
 
 
-def analyze_audio_file(audio_path: str, max_duration: float = None) -> dict:
+def recognize_chunks(audio_path: str, chunks: list, work_dir: str, concurrency: int = None, stats: dict = None,
+                      skip=None, defer=(), skip_ahead: bool = False, extraction_mode: str = None,
+                      pcm_buffer: PCMBuffer = None, deadline: float = None, on_chunk=None, windows=None,
+                      encoding_profile: str = None, learned: dict = None, waves: dict = None,
+                      samples: np.ndarray = None) -> list:
+    """Run chunks through a produce -> extract -> recognize pipeline and return one (parsed, error) pair per chunk."""
+    # At most `concurrency` chunks are recognized at once for this request; the
+    # AudD backend also caps its calls across all requests
+    workers = max(1, min(concurrency or RECOGNITION_WORKERS, MAX_RECOGNITION_WORKERS))
+    profile_name = encoding_profile or ENCODING_PROFILE
+    profile = ENCODING_PROFILES[profile_name]
+    skip = {} if skip is None else skip
+    # With skip_ahead, chunks inside a song predicted from an earlier match are
+    # skipped as late as possible: before encoding and again before recognition
+    songs = SkipAhead(chunks) if skip_ahead else None
+    # Scans that call this in rounds share `learned` (see recognize_chunk) across them
+    learned = {} if learned is None else learned
+    outcomes = [None] * len(chunks)
+    if windows is not None:
+        # `windows` (see LiveUpload.windows) plans chunks as the iterator goes, so outcomes grow with them
+        outcomes = []
+    dispatched = set()
+    cache_hits = []
+    local_hits = []
+    # Bounded queues let decoding, ffmpeg encodes and backend calls overlap while
+    # capping how many windows are held at once
+    extract_queue = queue.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+    upload_queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+    stages = {
+        'produce': {'workers': 1, 'items': 0, 'busy_seconds': 0.0, 'max_queue_depth': 0},
+        'extract': {'workers': EXTRACT_WORKERS, 'items': 0, 'busy_seconds': 0.0, 'max_queue_depth': 0},
+        'recognize': {'workers': workers, 'items': 0, 'busy_seconds': 0.0, 'max_queue_depth': 0}
+    }
+    lock = threading.Lock()
+    
+    def record(stage, started):
+        with lock:
+            stages[stage]['items'] += 1
+            stages[stage]['busy_seconds'] += time.monotonic() - started
+    
+    def put(stage, stage_queue, item):
+        stage_queue.put(item)
+        with lock:
+            stages[stage]['max_queue_depth'] = max(stages[stage]['max_queue_depth'], stage_queue.qsize())
+    
+    def settle(i, outcome):
+        # on_chunk((start_time, duration), outcome, skip_details) runs on the pipeline threads
+        outcomes[i] = outcome
+        if on_chunk is not None:
+            on_chunk(chunks[i], outcome, skip.get(i))
+    
+    def finish(i, parsed):
+        settle(i, (parsed, None))
+        if parsed and songs is not None:
+            songs.add(i, parsed)
+    
+    def fail(i, error):
+        if deadline_passed(deadline):
+            # Work cut short by the deadline is unscanned rather than failed
+            with lock:
+                skip[i] = {'reason': 'deadline'}
+            settle(i, (None, None))
+        else:
+            settle(i, (None, error))
+    
+    def out_of_time(i):
+        if not deadline_passed(deadline):
+            return False
+        fail(i, None)
+        return True
+    
+    def inside_song(i):
+        song = songs.skip(i) if songs is not None else None
+        if song is None:
+            return False
+        
+        with lock:
+            skip[i] = {'reason': 'inside_song', 'song': song}
+        settle(i, (None, None))
+        return True
+    
+    def cached(i, digest):
+        # A cached chunk skips extraction when its PCM digest is known up front, else the backend call
+        result = recognition_cache.get(f"{profile_name}|{digest}")
+        if result is None:
+            return False
+        
+        with lock:
+            cache_hits.append(i)
+        finish(i, recognition_router.parse(result))
+        return True
+    
+    def extract_worker():
+        while True:
+            item = extract_queue.get()
+            if item is None:
+                break
+            
+            i, extract, digest = item
+            if inside_song(i) or out_of_time(i):
+                continue
+            
+            chunk_path = os.path.join(work_dir, f"chunk_{i}{profile['extension']}")
+            started = time.monotonic()
+            hit = False
+            try:
+                extract(chunk_path, deadline=deadline, encoding_profile=encoding_profile)
+                if digest is None:
+                    # No PCM window was hashed up front; address the encoded chunk
+                    with open(chunk_path, 'rb') as f:
+                        digest = audio_digest(profile['format'], f.read())
+                    hit = cached(i, digest)
+            except Exception as e:
+                fail(i, str(e))
+                hit = True
+            finally:
+                record('extract', started)
+            
+            if hit:
+                if os.path.exists(chunk_path):
+                    os.remove(chunk_path)
+                continue
+            
+            put('recognize', upload_queue, (i, chunk_path, digest))
+    
+    def recognize_worker():
+        while True:
+            item = upload_queue.get()
+            if item is None:
+                break
+            
+            i, chunk_path, digest = item
+            if inside_song(i) or out_of_time(i):
+                os.remove(chunk_path)
+                continue
+            
+            started = time.monotonic()
+            try:
+                start_time, chunk_duration = chunks[i]
+                chunk_samples = None
+                if samples is not None:
+                    # Local matching slices the upload's analysis decode instead of decoding the chunk
+                    chunk_samples = samples[int(start_time * ANALYSIS_SAMPLE_RATE):
+                                            int((start_time + chunk_duration) * ANALYSIS_SAMPLE_RATE)]
+                result = recognize_chunk(chunk_path, deadline=deadline, span=(start_time, start_time + chunk_duration),
+                                         learned=learned, samples=chunk_samples)
+                if result.get('backend') == 'local':
+                    with lock:
+                        local_hits.append(i)
+                elif result.get('status') == 'success' and recognition_router.authoritative(result):
+                    # Fallback and hedge answers aren't kept as the chunk's truth
+                    recognition_cache.put(f"{profile_name}|{digest}", result)
+                finish(i, recognition_router.parse(result))
+            except Exception as e:
+                fail(i, str(e))
+            finally:
+                record('recognize', started)
+                # Clean up chunk file
+                if os.path.exists(chunk_path):
+                    os.remove(chunk_path)
+    
+    pipeline_started = time.monotonic()
+    extractors = [threading.Thread(target=extract_worker, daemon=True) for _ in range(EXTRACT_WORKERS)]
+    recognizers = [threading.Thread(target=recognize_worker, daemon=True) for _ in range(workers)]
+    for thread in extractors + recognizers:
+        thread.start()
+    
+    def dispatch(i, extract, digest):
+        if inside_song(i) or out_of_time(i) or digest is not None and cached(i, digest):
+            return
+        put('extract', extract_queue, (i, extract, digest))
+    
+    def redecode(group):
+        # One more single pass over a held-back group instead of a seek per chunk
+        pending = [i for i, _, _ in group]
+        try:
+            for n, start_time, chunk_duration, pcm in iter_pcm_windows(audio_path, [chunks[i] for i in pending],
+                                                                      deadline):
+                dispatch(pending[n], partial(encode_pcm_chunk, pcm), audio_digest('pcm', pcm))
+                pending[n] = None
+        except Exception as e:
+            for i in pending:
+                if i is not None:
+                    fail(i, str(e))
+    
+    def produce():
+        held = []
+        single_pass = windows is None and pcm_buffer is None and (extraction_mode or EXTRACTION_MODE) == 'single_pass'
+        try:
+            chunk_windows = windows or iter_chunk_extractors(audio_path, chunks, work_dir, extraction_mode, pcm_buffer,
+                                                             deadline)
+            while True:
+                started = time.monotonic()
+                try:
+                    i, start_time, chunk_duration, extract, digest = next(chunk_windows)
+                except StopIteration:
+                    break
+                record('produce', started)
+                outcomes.extend([None] * (len(chunks) - len(outcomes)))
+                
+                # Chunks in `skip` are never encoded or sent. Wave 0 goes out as the audio is
+                # decoded; later `waves` (see chunk_waves) follow wave by wave, then the `defer`red ones
+                dispatched.add(i)
+                if i in skip:
+                    settle(i, (None, None))
+                elif i in defer or waves and waves.get(i):
+                    # Single-pass windows aren't held until the end; they are decoded again
+                    held.append((i, None, None) if single_pass else (i, extract, digest))
+                else:
+                    dispatch(i, extract, digest)
+        
+        except Exception as e:
+            # Decoding failed; chunks that were never handed out report the error
+            outcomes.extend([None] * (len(chunks) - len(outcomes)))
+            for i in range(len(chunks)):
+                if i not in dispatched:
+                    fail(i, str(e))
+        
+        group_key = lambda item: (item[0] in defer, (waves or {}).get(item[0], 0))
+        held.sort(key=lambda item: (group_key(item), item[0]))
+        for _, group in itertools.groupby(held, key=group_key):
+            if single_pass:
+                redecode(list(group))
+            else:
+                for item in group:
+                    dispatch(*item)
+    
+    try:
+        produce()
+    
+    finally:
+        for _ in extractors:
+            extract_queue.put(None)
+        for thread in extractors:
+            thread.join()
+        for _ in recognizers:
+            upload_queue.put(None)
+        for thread in recognizers:
+            thread.join()
+    
+    # Cache hits and per-stage workers, items, busy time, utilization and peak input queue depth
+    if stats is not None:
+        wall = time.monotonic() - pipeline_started
+        for stage in stages.values():
+            stage['busy_seconds'] = round(stage['busy_seconds'], 3)
+            stage['utilization'] = round(stage['busy_seconds'] / (stage['workers'] * wall), 3) if wall else 0
+        stats['wall_seconds'] = round(wall, 3)
+        stats['cache_hits'] = len(cache_hits)
+        stats['local_hits'] = len(local_hits)
+        stats['stages'] = stages
+    
+    return outcomes
+
+
+def screen_chunks(audio_path: str, analyze_duration: float, chunks: list, silence_floor_db: float = None,
+                  speech_gate: str = 'off', music_threshold: float = None, deadline: float = None,
+                  repeats: bool = False, skip: dict = None, samples: np.ndarray = None) -> tuple:
+    """Run the cheap analysis passes over a low-rate decode of the upload.
+    
+    Returns ({index: skip details}, {indices to defer}). Chunks whose loudest
+    frame is under the loudness floor are skipped as silence. With the speech
+    gate on, chunks whose music score is under the threshold are skipped or
+    deferred depending on the gate mode. With `repeats`, chunks that repeat an
+    earlier chunk still to be sent are skipped as 'repeat', naming that chunk
+    in 'repeat_of'. Chunks already in `skip` keep their details. `samples` is
+    the upload's analysis decode, if already done.
+    """
+    floor = SILENCE_FLOOR_DB if silence_floor_db is None else silence_floor_db
+    threshold = MUSIC_THRESHOLD if music_threshold is None else music_threshold
+    if samples is None:
+        samples = decode_analysis_audio(audio_path, analyze_duration, deadline)
+    skipped, deferred = dict(skip or {}), set()
+    
+    if SKIP_SILENCE:
+        levels = chunk_peak_levels(samples, ANALYSIS_SAMPLE_RATE, chunks)
+        for i in np.nonzero(levels < floor)[0]:
+            skipped.setdefault(int(i), silence_skip(levels[i]))
+    
+    if speech_gate in ('skip', 'defer'):
+        scores = music_scores(samples, ANALYSIS_SAMPLE_RATE, chunks, floor_db=floor)
+        for i in np.nonzero(scores < threshold)[0]:
+            i = int(i)
+            if i in skipped:
+                continue
+            if speech_gate == 'skip':
+                skipped[i] = {'reason': 'speech', 'music_score': round(float(scores[i]), 3)}
+            else:
+                deferred.add(i)
+    
+    if repeats:
+        candidates = [i for i in range(len(chunks)) if i not in skipped and i not in deferred]
+        clusters = repeat_clusters(samples, ANALYSIS_SAMPLE_RATE, chunks, candidates, REPEAT_SIMILARITY)
+        for i, (first, similarity) in clusters.items():
+            skipped[i] = {'reason': 'repeat', 'repeat_of': first, 'similarity': round(similarity, 3)}
+    
+    return skipped, deferred
+
+
+class SongMerger:
+    """Merges detections into per-song time ranges as they arrive, in any order.
+    
+    Ranges of the same song are joined when they are at most MERGE_GAP apart,
+    so at any point the merged ranges are the same as merging everything added
+    so far in time order. A song's metadata (timecode, spotify, ...) is that of
+    its earliest detection, whichever order detections arrive in. Safe to
+    feed from several pipeline threads.
+    """
+    
+    # Merge consecutive time ranges for each song
+    # Use a 30-second gap tolerance — if the same song is detected
+    # again within 30 seconds of the last detection, treat it as
+    # one continuous occurrence (covers speech breaks, quiet moments, etc.)
+    MERGE_GAP = 30  # seconds
+    
+    def __init__(self, duration: float):
+        self.duration = duration
+        self.detected_songs = {}
+        self.sources = {}  # song key -> start time of the detection its metadata came from
+        self.lock = threading.Lock()
+    
+    def add(self, parsed: dict, start_time: float, end_time: float, detected: bool = True) -> tuple:
+        """Credit [start_time, end_time) to a song, as a detection or an inferred span.
+        
+        Returns (merged range, changed); changed is False when the span was
+        already inside one of the song's ranges.
+        """
+        end_time = min(end_time, self.duration)
+        key = song_key(parsed)
+        
+        with self.lock:
+            source = start_time if detected else float('inf')
+            if key not in self.detected_songs or source < self.sources[key]:
+                previous = self.detected_songs.get(key, {})
+                self.detected_songs[key] = {
+                    **parsed,
+                    'timestamps': previous.get('timestamps', []),
+                    'time_ranges': previous.get('time_ranges', [])
+                }
+                self.sources[key] = source
+            song_data = self.detected_songs[key]
+            if detected:
+                song_data['timestamps'].append(start_time)
+            
+            merged_start, merged_end = start_time, end_time
+            kept = []
+            for r in song_data['time_ranges']:
+                if r['start_seconds'] <= end_time + self.MERGE_GAP and start_time <= r['end_seconds'] + self.MERGE_GAP:
+                    # Merge with the overlapping or nearby range
+                    merged_start = min(merged_start, r['start_seconds'])
+                    merged_end = max(merged_end, r['end_seconds'])
+                else:
+                    kept.append(r)
+            
+            changed = len(kept) != len(song_data['time_ranges']) - 1 or not any(
+                r['start_seconds'] == merged_start and r['end_seconds'] == merged_end for r in song_data['time_ranges']
+            )
+            merged = {
+                'start': format_timestamp(merged_start),
+                'end': format_timestamp(merged_end),
+                'start_seconds': merged_start,
+                'end_seconds': merged_end
+            }
+            song_data['time_ranges'] = sorted(kept + [merged], key=lambda x: x['start_seconds'])
+            return dict(merged), changed
+    
+    def songs(self) -> list:
+        """Snapshot of the songs so far, sorted by first appearance."""
+        with self.lock:
+            songs = [
+                {**song_data, 'timestamps': sorted(song_data['timestamps']),
+                 'time_ranges': [dict(r) for r in song_data['time_ranges']]}
+                for song_data in self.detected_songs.values()
+            ]
+        
+        # Sort songs by first appearance
+        songs.sort(key=lambda x: x['time_ranges'][0]['start_seconds'] if x['time_ranges'] else 0)
+        return songs
+
+
+def chunk_status(outcome: tuple, skip_info: dict = None) -> str:
+    """The skip reason of a chunk, or 'matched', 'no_match' or 'error'."""
+    if skip_info:
+        return skip_info['reason']
+    parsed, error = outcome
+    return 'error' if error else 'matched' if parsed else 'no_match'
+
+
+def add_pipeline_stats(total: dict, stats: dict):
+    """Accumulate the stats of one recognize_chunks run into a running total."""
+    total['rounds'] = total.get('rounds', 0) + 1
+    total['wall_seconds'] = round(total.get('wall_seconds', 0) + stats['wall_seconds'], 3)
+    total['cache_hits'] = total.get('cache_hits', 0) + stats['cache_hits']
+    total['local_hits'] = total.get('local_hits', 0) + stats['local_hits']
+    
+    stages = total.setdefault('stages', {})
+    for name, stage in stats['stages'].items():
+        if name not in stages:
+            stages[name] = {'workers': stage['workers'], 'items': 0, 'busy_seconds': 0.0, 'max_queue_depth': 0}
+        stages[name]['items'] += stage['items']
+        stages[name]['busy_seconds'] = round(stages[name]['busy_seconds'] + stage['busy_seconds'], 3)
+        stages[name]['max_queue_depth'] = max(stages[name]['max_queue_depth'], stage['max_queue_depth'])
+        wall = total['wall_seconds'] * stages[name]['workers']
+        stages[name]['utilization'] = round(stages[name]['busy_seconds'] / wall, 3) if wall else 0
+
+
+def coarse_scan(audio_path: str, analyze_duration: float, work_dir: str, concurrency: int = None,
+                stats: dict = None, silence_floor_db: float = None, deadline: float = None, on_chunk=None,
+                encoding_profile: str = None, segments: list = (), samples: np.ndarray = None) -> tuple:
+    """Probe with a wide stride, then bisect only where neighbouring probes disagree.
+    
+    The first round probes one chunk every COARSE_STRIDE seconds. Each later
+    round probes the midpoint of every pair of neighbouring probes whose
+    outcomes differ (two songs, or a song and no match) until they are at most
+    REFINE_PRECISION seconds apart, which pins song boundaries to that
+    precision. Silent probes, and probes inside the known `segments` (see
+    find_known_segments), count as no match without a query. Music shorter
+    than the unprobed gap between two no-match probes can be missed.
+    `samples` is the upload's analysis decode, if already done.
+    
+    Returns (probes, outcomes, skipped, fill_ranges) with probes sorted by
+    start time. fill_ranges span neighbouring probes that matched the same
+    song, crediting the audio between them to it. If `deadline` cuts the
+    refinement short, the probes left are counted in stats['pending_probes'].
+    """
+    floor = SILENCE_FLOOR_DB if silence_floor_db is None else silence_floor_db
+    if samples is None and SKIP_SILENCE:
+        samples = decode_analysis_audio(audio_path, analyze_duration, deadline)
+    last_start = max(0.0, analyze_duration - CHUNK_DURATION)
+    pending = [float(t) for t in np.arange(0, last_start, COARSE_STRIDE)] + [last_start]
+    probes, outcomes, skip_info = [], [], []
+    total = {} if stats is None else stats
+    learned = {}
+    
+    def outcome_key(i):
+        parsed = outcomes[i][0]
+        return song_key(parsed) if parsed else None
+    
+    # Rounds probe scattered offsets, so seek per chunk unless a decoded buffer can be reused
+    pcm_buffer = PCMBuffer(audio_path, work_dir, deadline) if EXTRACTION_MODE == 'pcm_buffer' else None
+    try:
+        while pending and not deadline_passed(deadline):
+            round_chunks = [(t, min(CHUNK_DURATION, analyze_duration - t)) for t in pending]
+            round_skip = known_segment_skips(round_chunks, segments)
+            if samples is not None and SKIP_SILENCE:
+                levels = chunk_peak_levels(samples, ANALYSIS_SAMPLE_RATE, round_chunks)
+                for i in np.nonzero(levels < floor)[0]:
+                    round_skip.setdefault(int(i), silence_skip(levels[i]))
+            
+            round_stats = {}
+            outcomes += recognize_chunks(audio_path, round_chunks, work_dir, concurrency, stats=round_stats,
+                                         skip=round_skip, extraction_mode='per_chunk', pcm_buffer=pcm_buffer,
+                                         deadline=deadline, on_chunk=on_chunk, encoding_profile=encoding_profile,
+                                         learned=learned, samples=samples)
+            add_pipeline_stats(total, round_stats)
+            skip_info += [round_skip.get(i) for i in range(len(round_chunks))]
+            probes += round_chunks
+            
+            order = sorted(range(len(probes)), key=lambda i: probes[i][0])
+            pending = [
+                (probes[a][0] + probes[b][0]) / 2
+                for a, b in zip(order, order[1:])
+                if probes[b][0] - probes[a][0] > REFINE_PRECISION and outcome_key(a) != outcome_key(b)
+            ]
+    
+    finally:
+        if pcm_buffer is not None:
+            pcm_buffer.close()
+    if pending:
+        # Refinements the deadline cut off
+        total['pending_probes'] = len(pending)
+    
+    order = sorted(range(len(probes)), key=lambda i: probes[i][0])
+    fill_ranges = [
+        (probes[a][0], probes[b][0] + probes[b][1], outcomes[a][0])
+        for a, b in zip(order, order[1:])
+        if outcomes[a][0] and outcome_key(a) == outcome_key(b)
+    ]
+    skipped = {n: skip_info[i] for n, i in enumerate(order) if skip_info[i]}
+    return [probes[i] for i in order], [outcomes[i] for i in order], skipped, fill_ranges
+
+
+def budget_scan(audio_path: str, analyze_duration: float, chunks: list, work_dir: str, max_queries: int = None,
+                concurrency: int = None, stats: dict = None, silence_floor_db: float = None,
+                deadline: float = None, on_chunk=None, encoding_profile: str = None, skip: dict = None,
+                samples: np.ndarray = None) -> tuple:
+    """Spend at most `max_queries` AudD calls on the chunks expected to tell the most.
+    
+    Chunks are sent in rounds of `concurrency`, and each round picks the
+    highest-priority chunks left: those far from anything queried so far
+    (up to BUDGET_HORIZON seconds), then those with a high music score, then
+    neighbours of a detection, which pin down where songs start and end.
+    Silent chunks, chunks already in `skip` and chunks between two nearby
+    detections of the same song are never sent. Recognition cache hits and
+    local fingerprint matches do not count against the budget. `samples` is
+    the upload's analysis decode, if already done.
+    
+    Without `max_queries` the scan runs until every chunk is covered or
+    `deadline` passes, so the most informative chunks are done first.
+    
+    Returns (outcomes, skipped, fill_ranges); chunks left over when the budget
+    runs out are skipped with reason 'budget', or 'deadline' if time ran out.
+    """
+    floor = SILENCE_FLOOR_DB if silence_floor_db is None else silence_floor_db
+    workers = max(1, min(concurrency or RECOGNITION_WORKERS, MAX_RECOGNITION_WORKERS))
+    starts = np.array([start for start, _ in chunks], dtype=np.float64)
+    outcomes = [(None, None)] * len(chunks)
+    skipped = dict(skip or {})
+    learned = {}
+    
+    try:
+        if samples is None:
+            samples = decode_analysis_audio(audio_path, analyze_duration, deadline)
+        scores = music_scores(samples, ANALYSIS_SAMPLE_RATE, chunks, floor_db=floor)
+        if SKIP_SILENCE:
+            levels = chunk_peak_levels(samples, ANALYSIS_SAMPLE_RATE, chunks)
+            for i in np.nonzero(levels < floor)[0]:
+                skipped.setdefault(int(i), silence_skip(levels[i]))
+    except Exception:
+        # Without the analysis pass every chunk is equally likely to be music
+        scores = np.full(len(chunks), 0.5)
+    
+    def matched(i):
+        parsed = outcomes[i][0]
+        return song_key(parsed) if parsed else None
+    
+    def inferred(queried):
+        """Chunks between two nearby queried chunks that matched the same song."""
+        between = {}
+        order = sorted(queried)
+        for a, b in zip(order, order[1:]):
+            if matched(a) and matched(a) == matched(b) and starts[b] - starts[a] <= BUDGET_HORIZON:
+                between.update((i, matched(a)) for i in range(a + 1, b))
+        return between
+    
+    queried = []
+    total = {} if stats is None else stats
+    pcm_buffer = PCMBuffer(audio_path, work_dir, deadline) if EXTRACTION_MODE == 'pcm_buffer' else None
+    try:
+        used = 0
+        remaining = lambda: len(chunks) if max_queries is None else max_queries - used
+        while remaining() > 0 and not deadline_passed(deadline):
+            covered = inferred(queried)
+            candidates = [i for i in range(len(chunks)) if i not in skipped and i not in covered and i not in queried]
+            if not candidates:
+                break
+            
+            # Pick greedily so that each pick counts as covered for the next one
+            detected = {i for i in queried if matched(i)}
+            picked = []
+            for _ in range(min(workers, remaining(), len(candidates))):
+                known = starts[queried + picked]
+                
+                def priority(i):
+                    distance = np.abs(known - starts[i]).min() if len(known) else BUDGET_HORIZON
+                    neighbour = i - 1 in detected or i + 1 in detected
+                    return 2 * min(distance, BUDGET_HORIZON) / BUDGET_HORIZON + scores[i] + 0.5 * neighbour
+                
+                best = max(candidates, key=priority)
+                candidates.remove(best)
+                picked.append(best)
+            
+            round_stats, round_skip = {}, {}
+            round_outcomes = recognize_chunks(audio_path, [chunks[i] for i in picked], work_dir, concurrency,
+                                              stats=round_stats, skip=round_skip, extraction_mode='per_chunk',
+                                              pcm_buffer=pcm_buffer, deadline=deadline, on_chunk=on_chunk,
+                                              encoding_profile=encoding_profile, learned=learned, samples=samples)
+            add_pipeline_stats(total, round_stats)
+            used += round_stats['stages']['recognize']['items'] - round_stats['local_hits']
+            for n, i in enumerate(picked):
+                outcomes[i] = round_outcomes[n]
+                if n in round_skip:
+                    skipped[i] = round_skip[n]
+                else:
+                    queried.append(i)
+    
+    finally:
+        if pcm_buffer is not None:
+            pcm_buffer.close()
+    
+    covered = inferred(queried)
+    for i in range(len(chunks)):
+        if i in covered:
+            skipped[i] = {'reason': 'inferred', 'song': covered[i]}
+        elif i not in skipped and i not in queried:
+            reason = 'deadline' if deadline_passed(deadline) else 'budget'
+            skipped[i] = {'reason': reason, 'music_score': round(float(scores[i]), 3)}
+    
+    order = sorted(queried)
+    fill_ranges = [
+        (chunks[a][0], sum(chunks[b]), outcomes[a][0])
+        for a, b in zip(order, order[1:])
+        if matched(a) and matched(a) == matched(b) and starts[b] - starts[a] <= BUDGET_HORIZON
+    ]
+    return outcomes, skipped, fill_ranges
+
+
+def coverage_map(chunks: list, outcomes: list, skipped: dict, analyze_duration: float) -> list:
+    """Describe what is known about each stretch of the scanned audio.
+    
+    Every chunk claims the time up to the next chunk's start, or its own end if
+    the next chunk starts later. Its status is the skip reason if it was
+    skipped, else 'matched', 'no_match' or 'error'; inside_song chunks that no
+    scanned chunk confirmed are 'unscanned'. Time between chunks is 'inferred'
+    when both sides matched the same song and 'unscanned' otherwise.
+    Neighbouring stretches with the same status are merged.
+    """
+    stretches = []
+    
+    def add(start_time, end_time, state):
+        if end_time <= start_time:
+            return
+        if stretches and stretches[-1][2] == state and stretches[-1][1] >= start_time:
+            stretches[-1][1] = max(stretches[-1][1], end_time)
+        else:
+            stretches.append([start_time, end_time, state])
+    
+    position = 0.0
+    for i, (start_time, chunk_duration) in enumerate(chunks):
+        if start_time > position:
+            same_song = (i > 0 and outcomes[i - 1][0] and outcomes[i][0]
+                         and song_key(outcomes[i - 1][0]) == song_key(outcomes[i][0]))
+            add(position, start_time, 'inferred' if same_song else 'unscanned')
+        next_start = chunks[i + 1][0] if i + 1 < len(chunks) else analyze_duration
+        position = min(start_time + chunk_duration, max(next_start, start_time))
+        skip_info = skipped.get(i)
+        if skip_info and skip_info['reason'] == 'inside_song' and not skip_info.get('confirmed'):
+            add(start_time, position, 'unscanned')
+        else:
+            add(start_time, position, chunk_status(outcomes[i], skip_info))
+    add(position, analyze_duration, 'unscanned')
+    
+    return [{
+        'start': format_timestamp(start_time),
+        'end': format_timestamp(end_time),
+        'start_seconds': start_time,
+        'end_seconds': end_time,
+        'status': state
+    } for start_time, end_time, state in stretches]
+
+
+def analyze_audio_file(audio_path: str, max_duration: float = None, concurrency: int = None,
+                       silence_floor_db: float = None, thorough: bool = False,
+                       music_threshold: float = None, strategy: str = None, max_queries: int = None,
+                       deadline_ms: float = None, encoding_profile: str = None, progress=None, on_event=None,
+                       upload: LiveUpload = None) -> dict:
     """Main function to analyze an audio file for copyrighted music."""
     results = {
         'songs': [],
@@ -122,93 +1727,216 @@ def analyze_audio_file(audio_path: str, max_duration: float = None) -> dict:
         'errors': []
     }
     
+    # Work still running at the deadline is cancelled; the result then has
+    # complete: false and lists the unscanned_ranges
+    deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms is not None else None
     temp_dir = tempfile.mkdtemp()
+    done = itertools.count(1)
+    started = time.monotonic()
+    merger = None
     
-    try:
-        # Get duration
-        duration = get_audio_duration(audio_path)
+    # on_event gets a 'chunk' event as each chunk finishes and a 'song_range' event whenever
+    # a song's merged range appears or grows, from the pipeline threads while the scan runs
+    def emit(event, **fields):
+        if on_event is not None:
+            on_event({'event': event, 'elapsed_seconds': round(time.monotonic() - started, 3), **fields})
+    
+    def add_range(parsed, start_time, end_time, detected=True):
+        merged, changed = merger.add(parsed, start_time, end_time, detected)
+        if changed:
+            emit('song_range', title=parsed['title'], artists=parsed['artists'], **merged)
+    
+    def on_chunk(chunk, outcome, skip_info):
+        start_time, chunk_duration = chunk
+        parsed, error = outcome
+        if progress is not None:
+            count = next(done)
+            progress(count, max(count, results['analysis_chunks']))
+        
+        emit('chunk', start=format_timestamp(start_time), end=format_timestamp(start_time + chunk_duration),
+             start_seconds=start_time, end_seconds=start_time + chunk_duration,
+             status=chunk_status(outcome, skip_info), error=error,
+             title=parsed['title'] if parsed else None, artists=parsed['artists'] if parsed else None)
+        if parsed:
+            add_range(parsed, start_time, start_time + chunk_duration)
+    
+    def measure(duration):
         results['audio_duration'] = duration
         results['audio_duration_formatted'] = format_timestamp(duration)
         
         # Apply max_duration limit if set
-        analyze_duration = duration
         if max_duration and max_duration < duration:
-            analyze_duration = max_duration
             results['scan_mode'] = f'First {format_timestamp(max_duration)}'
+            return max_duration
+        results['scan_mode'] = 'Full audio'
+        return duration
+    
+    try:
+        if upload is None:
+            # Get duration
+            duration = get_audio_duration(audio_path)
+            analyze_duration = measure(duration)
         else:
-            results['scan_mode'] = 'Full audio'
-        
-        # Calculate chunks
-        chunks = []
-        current_time = 0
-        while current_time < analyze_duration:
-            chunk_end = min(current_time + CHUNK_DURATION, analyze_duration)
-            chunks.append((current_time, chunk_end - current_time))
-            current_time += CHUNK_DURATION - OVERLAP
+            # A LiveUpload is scanned while it is still decoded (audio_path is its spool
+            # file), so the duration is only known once the whole upload has been decoded
+            duration = analyze_duration = max_duration or float('inf')
+        merger = SongMerger(duration)
         
+        # Calculate chunks: 'dense' sends every overlapping chunk and 'coarse' probes and
+        # bisects (see coarse_scan); a query budget, capped by MAX_QUERIES, means budget_scan
+        budget = min([n for n in (max_queries or 0, MAX_QUERIES) if n > 0], default=None)
+        strategy = strategy or SCAN_STRATEGY
+        if upload is not None:
+            # Chunks are planned as the upload arrives, so only an in-order scan can keep up
+            strategy = 'dense'
+        elif budget:
+            strategy = 'budget'
+        results['scan_strategy'] = strategy
+        results['encoding_profile'] = encoding_profile or ENCODING_PROFILE
+        chunks = plan_chunks(analyze_duration) if upload is None else []
         results['analysis_chunks'] = len(chunks)
+        results['dense_chunks'] = len(chunks)
         
-        # Analyze each chunk
-        detected_songs = {}
+        # Label segments from the known-segment library before anything is sent; they are
+        # listed in songs with their status and the chunks inside them skipped as 'known_segment'
+        samples = None
+        segments = []
+        if upload is None and len(segment_index):
+            try:
+                samples = decode_analysis_audio(audio_path, analyze_duration, deadline)
+                segments = find_known_segments(samples)
+            except Exception as e:
+                results['errors'].append(f"Known segment matching failed: {str(e)}")
+        results['known_segments'] = len(segments)
+        known = known_segment_skips(chunks, segments)
         
-        for i, (start_time, chunk_duration) in enumerate(chunks):
-            chunk_path = os.path.join(temp_dir, f'chunk_{i}.mp3')
-            
+        # Local matching and learning slice every chunk from one analysis decode
+        if upload is None and samples is None and (len(fingerprint_index) or len(learned_index) or LEARN_FROM_AUDD):
             try:
-                extract_audio_chunk(audio_path, start_time, chunk_duration, chunk_path)
-                
-                result = recognize_with_audd(chunk_path)
-                parsed = parse_audd_result(result)
-                
-                if parsed:
-                    song_key = f"{parsed['title']}|{'|'.join(parsed['artists'])}"
-                    
-                    if song_key not in detected_songs:
-                        detected_songs[song_key] = {
-                            **parsed,
-                            'timestamps': [],
-                            'time_ranges': []
-                        }
-                    
-                    detected_songs[song_key]['timestamps'].append(start_time)
-                    detected_songs[song_key]['time_ranges'].append({
-                        'start': format_timestamp(start_time),
-                        'end': format_timestamp(min(start_time + chunk_duration, duration)),
-                        'start_seconds': start_time,
-                        'end_seconds': min(start_time + chunk_duration, duration)
-                    })
-                
-                # Clean up chunk file
-                if os.path.exists(chunk_path):
-                    os.remove(chunk_path)
-                    
+                samples = decode_analysis_audio(audio_path, analyze_duration, deadline)
             except Exception as e:
-                results['errors'].append(f"Chunk {i} ({format_timestamp(start_time)}): {str(e)}")
+                results['errors'].append(f"Analysis decode failed: {str(e)}")
         
-        # Merge consecutive time ranges for each song
-        # Use a 30-second gap tolerance — if the same song is detected
-        # again within 30 seconds of the last detection, treat it as
-        # one continuous occurrence (covers speech breaks, quiet moments, etc.)
-        MERGE_GAP = 30  # seconds
+        # Leave out or hold back chunks with nothing worth recognizing; `thorough` sends
+        # every audible chunk (no speech gate, repeat skipping or skipping ahead)
+        gate = 'off' if thorough or strategy != 'dense' or upload is not None else SPEECH_GATE
+        if gate == 'defer' and deadline is None:
+            gate = 'off'
+        repeats = SKIP_REPEATS and not thorough
+        skipped, deferred = dict(known), set()
+        results['skipped_chunks'] = []
+        if strategy == 'dense' and chunks and (SKIP_SILENCE or gate != 'off' or repeats):
+            try:
+                skipped, deferred = screen_chunks(audio_path, analyze_duration, chunks, silence_floor_db, gate, music_threshold,
+                                                  deadline, repeats, skip=known, samples=samples)
+            except Exception as e:
+                results['errors'].append(f"Chunk screening failed: {str(e)}")
+        results['speech_gate'] = {'mode': gate, 'deferred_chunks': len(deferred)}
         
-        for song_key, song_data in detected_songs.items():
-            merged_ranges = []
-            ranges = sorted(song_data['time_ranges'], key=lambda x: x['start_seconds'])
-            
-            for r in ranges:
-                if merged_ranges and r['start_seconds'] <= merged_ranges[-1]['end_seconds'] + MERGE_GAP:
-                    # Merge with previous range
-                    merged_ranges[-1]['end_seconds'] = max(merged_ranges[-1]['end_seconds'], r['end_seconds'])
-                    merged_ranges[-1]['end'] = format_timestamp(merged_ranges[-1]['end_seconds'])
-                else:
-                    merged_ranges.append(r.copy())
+        # Analyze each chunk
+        results['pipeline'] = {}
+        fill_ranges = []
+        if strategy == 'coarse':
+            chunks, outcomes, skipped, fill_ranges = coarse_scan(audio_path, analyze_duration, temp_dir, concurrency,
+                                                                stats=results['pipeline'], silence_floor_db=silence_floor_db,
+                                                                deadline=deadline, on_chunk=on_chunk,
+                                                                encoding_profile=encoding_profile, segments=segments,
+                                                                samples=samples)
+            results['analysis_chunks'] = len(chunks)
+            results['refine_rounds'] = results['pipeline'].pop('rounds', 0)
+        elif strategy == 'budget':
+            outcomes, skipped, fill_ranges = budget_scan(audio_path, analyze_duration, chunks, temp_dir, budget, concurrency,
+                                                         stats=results['pipeline'], silence_floor_db=silence_floor_db,
+                                                         deadline=deadline, on_chunk=on_chunk,
+                                                         encoding_profile=encoding_profile, skip=known, samples=samples)
+            results['query_budget'] = budget
+            results['pipeline'].pop('rounds', None)
+        else:
+            # Under a deadline chunks go out coarse-to-fine (see chunk_waves), spreading coverage over the file
+            outcomes = recognize_chunks(audio_path, chunks, temp_dir, concurrency, stats=results['pipeline'],
+                                        skip=skipped, defer=deferred, skip_ahead=SKIP_AHEAD and not thorough,
+                                        deadline=deadline, on_chunk=on_chunk,
+                                        windows=upload and upload.windows(chunks, skipped, silence_floor_db, deadline),
+                                        encoding_profile=encoding_profile,
+                                        waves=chunk_waves(len(chunks)) if deadline is not None and upload is None else None,
+                                        samples=samples)
+            if upload is not None:
+                duration = upload.finish()
+                analyze_duration = measure(duration)
+                if deadline_passed(deadline):
+                    # The deadline stopped chunk planning; the rest of the upload is unscanned
+                    for start_time, chunk_duration in plan_chunks(analyze_duration)[len(chunks):]:
+                        skipped[len(chunks)] = {'reason': 'deadline'}
+                        chunks.append((start_time, chunk_duration))
+                        outcomes.append((None, None))
+                results['analysis_chunks'] = results['dense_chunks'] = len(chunks)
+        results['queries_used'] = (results['pipeline'].get('stages', {}).get('recognize', {}).get('items', 0)
+                                   - results['pipeline'].get('local_hits', 0))
+        
+        for i in sorted(skipped):
+            start_time, chunk_duration = chunks[i]
+            if skipped[i]['reason'] == 'inside_song':
+                # Count the chunk towards the song once the next scanned chunk confirms it, or
+                # the one before it when the upload (or max_duration) ends inside the song
+                sample = next((j for j in range(i + 1, len(chunks)) if j not in skipped), None)
+                if sample is None:
+                    sample = next((j for j in range(i - 1, -1, -1) if j not in skipped), None)
+                confirmation = outcomes[sample][0] if sample is not None else None
+                skipped[i]['confirmed'] = bool(confirmation) and song_key(confirmation) == skipped[i]['song']
+                if skipped[i]['confirmed']:
+                    outcomes[i] = (confirmation, None)
+                    add_range(confirmation, start_time, start_time + chunk_duration)
+            elif skipped[i]['reason'] == 'repeat':
+                # A repeat gets the result of its cluster's first chunk, settled by now, or
+                # shares its fate when the deadline cut that chunk off or it failed
+                leader = skipped[i]['repeat_of']
+                parsed, error = outcomes[leader]
+                if skipped.get(leader, {}).get('reason') == 'deadline':
+                    skipped[i] = {'reason': 'deadline', 'repeat_of': leader}
+                elif error:
+                    del skipped[i]
+                    outcomes[i] = (None, error)
+                    continue
+                outcomes[i] = (parsed, None)
+                if parsed:
+                    add_range(parsed, start_time, start_time + chunk_duration)
             
-            song_data['time_ranges'] = merged_ranges
-            results['songs'].append(song_data)
+            results['skipped_chunks'].append({
+                'index': i,
+                'start': format_timestamp(start_time),
+                'end': format_timestamp(start_time + chunk_duration),
+                'start_seconds': start_time,
+                'end_seconds': start_time + chunk_duration,
+                **skipped[i]
+            })
+        results['complete'] = (not any(info['reason'] == 'deadline' for info in skipped.values())
+                               and not results['pipeline'].pop('pending_probes', 0))
         
-        # Sort songs by first appearance
-        results['songs'].sort(key=lambda x: x['time_ranges'][0]['start_seconds'] if x['time_ranges'] else 0)
+        for i, (start_time, chunk_duration) in enumerate(chunks):
+            error = outcomes[i][1]
+            if error:
+                results['errors'].append(f"Chunk {i} ({format_timestamp(start_time)}): {error}")
+        
+        for start_time, end_time, parsed in segments:
+            add_range(parsed, start_time, end_time)
         
+        for start_time, end_time, parsed in fill_ranges:
+            add_range(parsed, start_time, end_time, detected=False)
+        
+        results['songs'] = merger.songs()
+        
+        results['coverage_map'] = coverage_map(chunks, outcomes, skipped, analyze_duration)
+        unscanned_ranges = results['unscanned_ranges'] = []
+        for r in results['coverage_map']:
+            if r['status'] not in ('unscanned', 'budget', 'deadline', 'error'):
+                continue
+            if unscanned_ranges and unscanned_ranges[-1]['end_seconds'] >= r['start_seconds']:
+                unscanned_ranges[-1].update(end=r['end'], end_seconds=r['end_seconds'])
+            else:
+                unscanned_ranges.append({name: r[name] for name in ('start', 'end', 'start_seconds', 'end_seconds')})
+        unscanned = sum(r['end_seconds'] - r['start_seconds'] for r in unscanned_ranges)
+        results['coverage'] = round(1 - unscanned / analyze_duration, 3) if analyze_duration else 0
+    
     except Exception as e:
         results['errors'].append(str(e))
     
@@ -220,65 +1948,548 @@ def analyze_audio_file(audio_path: str, max_duration: float = None) -> dict:
     return results
 
 
+class AudioTooLong(ValueError):
+    """An upload declares a duration over MAX_AUDIO_DURATION."""
+
+
+class PeekedStream:
+    """A read-only stream that returns already read `head` bytes before the rest of `stream`."""
+    
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+    
+    def read(self, size: int = -1) -> bytes:
+        if not self.head:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            block, self.head = self.head + self.stream.read(), b''
+        else:
+            block, self.head = self.head[:size], self.head[size:]
+        return block
+
+
+def check_upload(stream, size: int = None):
+    """Refuse an upload whose header declares more than MAX_AUDIO_DURATION.
+    
+    Reads the first UPLOAD_PROBE_SIZE bytes and returns a stream that still
+    yields the whole upload. `size` is the upload's length when known, which
+    lets CBR MP3s without a Xing header be checked too.
+    """
+    if not MAX_AUDIO_DURATION:
+        return stream
+    
+    head = b''
+    while len(head) < UPLOAD_PROBE_SIZE:
+        block = stream.read(UPLOAD_PROBE_SIZE - len(head))
+        if not block:
+            break
+        head += block
+    
+    duration = probe.stream_duration(io.BytesIO(head), size)
+    if duration is not None and duration > MAX_AUDIO_DURATION:
+        raise AudioTooLong(f'Audio is {format_timestamp(duration)} long; the limit is {format_timestamp(MAX_AUDIO_DURATION)}')
+    return PeekedStream(head, stream)
+
+
+def upload_size(file) -> int:
+    """Length of a multipart upload that Flask has already spooled, or None."""
+    try:
+        size = file.stream.seek(0, os.SEEK_END)
+        file.stream.seek(0)
+        return size
+    except (AttributeError, OSError):
+        return None
+
+
+def save_upload(stream, path: str) -> str:
+    """Stream an uploaded file to disk, returning the SHA-256 of its bytes."""
+    digest = hashlib.sha256()
+    
+    with open(path, 'wb') as out:
+        while True:
+            block = stream.read(UPLOAD_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    
+    return digest.hexdigest()
+
+
+def result_cache_key(digest: str, **params) -> str:
+    """Key a whole-upload result by file digest, scan parameters and chunk layout."""
+    params.update(chunk_duration=CHUNK_DURATION, overlap=OVERLAP)
+    return digest + '|' + '|'.join(f"{name}={params[name]}" for name in sorted(params))
+
+
 @app.route('/')
 def index():
     return jsonify({'status': 'SoundScan API is running', 'version': '2.0'})
 
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze():
-    """API endpoint to analyze an uploaded audio file."""
-    
+ALLOWED_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac', '.wma', '.mp4', '.webm'}
+# Containers that may keep their index at the end of the file, so ffmpeg can't decode them from a pipe
+SPOOLED_EXTENSIONS = {'.m4a', '.mp4'}
+
+
+def uploaded_file() -> tuple:
+    """Return the request's upload and its extension, or raise ValueError."""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
+        raise ValueError('No file uploaded')
     
     file = request.files['file']
     
     if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
+        raise ValueError('No file selected')
     
     # Check file extension
-    allowed_extensions = {'.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac', '.wma', '.mp4', '.webm'}
     file_ext = os.path.splitext(file.filename)[1].lower()
     
-    if file_ext not in allowed_extensions:
-        return jsonify({'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'}), 400
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}')
+    
+    return file, file_ext
+
+
+def analysis_options(form) -> dict:
+    """Read the scan settings shared by /api/analyze and /api/jobs, or raise ValueError."""
+    # Check for max_duration parameter (in seconds)
+    max_duration = form.get('max_duration', None)
+    max_duration = float(max_duration) if max_duration else None
+    
+    # Optional per-request recognition concurrency
+    concurrency = form.get('concurrency', None)
+    concurrency = int(concurrency) if concurrency else None
+    
+    # Optional loudness floor (dBFS) below which chunks are skipped as silent
+    silence_floor_db = form.get('silence_floor_db', None)
+    silence_floor_db = float(silence_floor_db) if silence_floor_db else None
+    
+    # 'thorough' sends every audible chunk, music_threshold tunes the speech gate
+    thorough = form.get('thorough', '').lower() in ('1', 'true', 'yes')
+    music_threshold = form.get('music_threshold', None)
+    music_threshold = float(music_threshold) if music_threshold else None
+    
+    # Scan strategy: 'dense' or 'coarse'
+    strategy = form.get('strategy', None) or SCAN_STRATEGY
+    if strategy not in ('dense', 'coarse'):
+        raise ValueError("Invalid strategy. Allowed: dense, coarse")
+    
+    # Optional cap on AudD calls for this file; replaces the strategy with budget scheduling
+    max_queries = form.get('max_queries', None)
+    max_queries = int(max_queries) if max_queries else None
+    if max_queries is not None and max_queries < 1:
+        raise ValueError('max_queries must be at least 1')
+    
+    # Optional time limit; whatever is unscanned when it hits is reported, not waited for
+    deadline_ms = form.get('deadline_ms', None)
+    deadline_ms = float(deadline_ms) if deadline_ms else None
+    
+    # Format of the chunks sent for recognition
+    encoding_profile = form.get('encoding_profile', None) or ENCODING_PROFILE
+    if encoding_profile not in ENCODING_PROFILES:
+        raise ValueError(f'Invalid encoding_profile. Allowed: {", ".join(ENCODING_PROFILES)}')
+    
+    return {
+        'max_duration': max_duration,
+        'concurrency': concurrency,
+        'silence_floor_db': silence_floor_db,
+        'thorough': thorough,
+        'music_threshold': music_threshold,
+        'strategy': strategy,
+        'max_queries': max_queries,
+        'deadline_ms': deadline_ms,
+        'encoding_profile': encoding_profile
+    }
+
+
+def charge_receive_time(options: dict, received: float):
+    """Take the time since the request was `received` (time.monotonic()) off the scan's deadline."""
+    deadline_ms = options['deadline_ms'] or ANALYZE_DEADLINE_MS or None
+    if deadline_ms is not None:
+        options['deadline_ms'] = max(0.0, deadline_ms - (time.monotonic() - received) * 1000)
+
+
+def analysis_cache_key(digest: str, options: dict) -> str:
+    """Result cache key for an upload scanned with analysis_options()."""
+    return result_cache_key(digest, max_queries_cap=MAX_QUERIES, reference_index=fingerprint_index.revision(),
+                            segment_library=segment_index.revision(), **{
+        name: value for name, value in options.items() if name not in ('concurrency', 'deadline_ms')
+    })
+
+
+def run_analysis(audio_path: str, digest: str, options: dict, progress=None, on_event=None) -> dict:
+    """Analyze an upload, reusing the cached result of an identical earlier scan."""
+    # Re-submits of the same file with the same scan settings reuse the last result
+    cache_key = analysis_cache_key(digest, options)
+    results = result_cache.get(cache_key)
+    if results is not None:
+        return {**results, 'cache_hit': True}
+    
+    results = analyze_audio_file(audio_path, progress=progress, on_event=on_event, **options)
+    results['cache_hit'] = False
+    if not results['errors'] and results.get('complete', True):
+        result_cache.put(cache_key, dict(results))
+    return results
+
+
+@app.route('/api/analyze', methods=['POST'])
+def analyze():
+    """API endpoint to analyze an uploaded audio file."""
+    
+    received = time.monotonic()
+    
+    if request.mimetype != 'multipart/form-data':
+        return analyze_raw(received)
+    
+    try:
+        file, file_ext = uploaded_file()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Save uploaded file temporarily
     temp_dir = tempfile.mkdtemp()
     temp_path = os.path.join(temp_dir, f'upload{file_ext}')
     
     try:
-        file.save(temp_path)
+        digest = save_upload(check_upload(file.stream, upload_size(file)), temp_path)
+        
+        try:
+            options = analysis_options(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Check for max_duration parameter (in seconds)
-        max_duration = request.form.get('max_duration', None)
-        if max_duration:
-            max_duration = float(max_duration)
+        charge_receive_time(options, received)
         
-        results = analyze_audio_file(temp_path, max_duration=max_duration)
+        results = run_analysis(temp_path, digest, options)
         results['filename'] = file.filename
         return jsonify(results)
-        
+    
+    except AudioTooLong as e:
+        return jsonify({'error': str(e)}), 413
+    
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    finally:
+        # Clean up
+        import shutil
+        release_upload(temp_path)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def analyze_raw(received: float):
+    """Analyze an upload sent as the raw request body, scanning while it arrives.
+    
+    The file name comes from ?filename= or an X-Filename header and the scan
+    settings from the query string. Dense scans without a query budget are
+    decoded and recognized while the body is still being received; anything
+    else, and containers in SPOOLED_EXTENSIONS, is received in full first.
+    """
+    filename = request.args.get('filename') or request.headers.get('X-Filename', '')
+    file_ext = os.path.splitext(filename)[1].lower()
+    
+    if file_ext not in ALLOWED_EXTENSIONS:
+        return jsonify({'error': f'Invalid file type. Allowed: {", ".join(ALLOWED_EXTENSIONS)}'}), 400
+    
+    try:
+        options = analysis_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    charge_receive_time(options, received)
+    
+    live = (file_ext not in SPOOLED_EXTENSIONS and options['strategy'] == 'dense'
+            and not (options['max_queries'] or MAX_QUERIES))
+    temp_dir = tempfile.mkdtemp()
+    temp_path = os.path.join(temp_dir, f'upload{file_ext}')
+    
+    try:
+        stream = check_upload(request.stream, request.content_length)
+        if not live:
+            digest = save_upload(stream, temp_path)
+            results = run_analysis(temp_path, digest, options)
+        else:
+            upload = LiveUpload(stream, temp_path, options['max_duration'])
+            try:
+                results = analyze_audio_file(temp_path, upload=upload, **options)
+            finally:
+                upload.close()
+            
+            # Live scans skip segments, the speech gate and repeats, so their results
+            # aren't stored where a spooled scan of the same file would find them
+            results['cache_hit'] = False
         
+        results['filename'] = filename
+        results['live_upload'] = live
+        return jsonify(results)
+    
+    except AudioTooLong as e:
+        return jsonify({'error': str(e)}), 413
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
     finally:
         # Clean up
         import shutil
+        release_upload(temp_path)
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Streaming variant of /api/analyze.
+    
+    Sends a 'chunk' event per finished chunk and a 'song_range' event per new
+    or grown song range while the scan runs, then a 'summary' event with the
+    full result. Events are NDJSON lines, or Server-Sent Events when the client
+    accepts text/event-stream or passes ?format=sse.
+    """
+    received = time.monotonic()
+    
+    try:
+        file, file_ext = uploaded_file()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sse = request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+    temp_dir = tempfile.mkdtemp()
+    temp_path = os.path.join(temp_dir, f'upload{file_ext}')
+    
+    try:
+        digest = save_upload(check_upload(file.stream, upload_size(file)), temp_path)
+        options = analysis_options(request.form)
+    except Exception as e:
+        import shutil
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        status = 413 if isinstance(e, AudioTooLong) else 400 if isinstance(e, ValueError) else 500
+        return jsonify({'error': str(e)}), status
+    
+    charge_receive_time(options, received)
+    
+    filename = file.filename
+    events = queue.Queue()
+    
+    def scan():
+        try:
+            results = run_analysis(temp_path, digest, options, on_event=events.put)
+            results['filename'] = filename
+            events.put({'event': 'summary', **results})
+        except Exception as e:
+            events.put({'event': 'error', 'error': str(e)})
+        finally:
+            import shutil
+            release_upload(temp_path)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            events.put(None)
+    
+    # The scan runs to completion even if the client goes away, so its result is cached
+    threading.Thread(target=scan, daemon=True).start()
+    
+    def generate():
+        while True:
+            try:
+                event = events.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield ': heartbeat\n\n' if sse else json.dumps({'event': 'heartbeat'}) + '\n'
+                continue
+            
+            if event is None:
+                break
+            if sse:
+                yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+            else:
+                yield json.dumps(event) + '\n'
+    
+    return Response(generate(), mimetype='text/event-stream' if sse else 'application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def run_job(job: dict, progress) -> dict:
+    """Run a queued /api/jobs analysis and remove its upload once it finishes."""
+    params = job['params']
+    try:
+        results = run_analysis(params['upload_path'], params['digest'], params['options'], progress)
+        results['filename'] = params['filename']
+        return results
+    finally:
+        release_upload(params['upload_path'])
+        if os.path.exists(params['upload_path']):
+            os.remove(params['upload_path'])
+
+
+job_queue = JobQueue(JOBS_PATH, run_job, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL,
+                     lease=JOB_LEASE)
+
+
+@app.before_request
+def start_job_queue():
+    """Start the job workers in a process once it serves requests, not when app is imported."""
+    job_queue.start()
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue an uploaded audio file for analysis and return the job id straight away."""
+    try:
+        file, file_ext = uploaded_file()
+        options = analysis_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    fd, upload_path = tempfile.mkstemp(suffix=file_ext, dir=JOB_UPLOAD_DIR)
+    os.close(fd)
+    
+    try:
+        digest = save_upload(check_upload(file.stream, upload_size(file)), upload_path)
+        job_id = job_queue.submit({
+            'upload_path': upload_path,
+            'digest': digest,
+            'filename': file.filename,
+            'options': options
+        })
+    except Exception as e:
+        os.remove(upload_path)
+        return jsonify({'error': str(e)}), 413 if isinstance(e, AudioTooLong) else 503
+    
+    return jsonify({'job_id': job_id, 'status': 'queued', 'url': f'/api/jobs/{job_id}'}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report a job's status, progress and, once it is done, its result."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'filename': job['params']['filename'],
+        'progress': {'done': job['done'], 'total': job['total']},
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'result': job['result'],
+        'error': job['error']
+    })
+
+
+def admin_error():
+    """The error response for a request without the admin token, or None."""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+
+@app.route('/api/admin/segments', methods=['POST'])
+def add_segment():
+    """Register a recurring segment (show intro, ad bed, library cue) in the known-segment library.
+    
+    Form fields: `file`, `title`, `status` ('cleared' by default, or 'known')
+    and optionally `artist` and `label`.
+    """
+    error = admin_error()
+    if error is not None:
+        return error
+    
+    try:
+        file, file_ext = uploaded_file()
+        title = request.form.get('title', '').strip()
+        status = request.form.get('status', 'cleared')
+        if not title:
+            raise ValueError('A title is required')
+        if status not in SEGMENT_STATUSES:
+            raise ValueError(f"Invalid status. Allowed: {', '.join(SEGMENT_STATUSES)}")
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    metadata = {'title': title, 'status': status}
+    for field in ('artist', 'label'):
+        if request.form.get(field):
+            metadata[field] = request.form[field].strip()
+    
+    fd, upload_path = tempfile.mkstemp(suffix=file_ext)
+    os.close(fd)
+    try:
+        save_upload(file.stream, upload_path)
+        samples = decode_analysis_audio(upload_path, MAX_SEGMENT_DURATION + 1)
+        if len(samples) > MAX_SEGMENT_DURATION * ANALYSIS_SAMPLE_RATE:
+            return jsonify({'error': f'Segments are limited to {format_timestamp(MAX_SEGMENT_DURATION)}'}), 413
+        segment_id = segment_index.add(samples, metadata)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        os.remove(upload_path)
+    
+    if not len(segment_index.postings[segment_id][0]):
+        segment_index.remove(segment_id)
+        return jsonify({'error': 'The segment has no distinctive audio to fingerprint'}), 400
+    return jsonify({'segment_id': segment_id, **segment_index.tracks[segment_id]}), 201
+
+
+@app.route('/api/admin/segments', methods=['GET'])
+def list_segments():
+    """List the known-segment library."""
+    error = admin_error()
+    if error is not None:
+        return error
+    
+    return jsonify({'segments': [
+        {'segment_id': segment_id, **metadata} for segment_id, metadata in sorted(segment_index.tracks.items())
+    ]})
+
+
+@app.route('/api/admin/segments/<int:segment_id>', methods=['DELETE'])
+def delete_segment(segment_id):
+    """Remove a segment from the known-segment library."""
+    error = admin_error()
+    if error is not None:
+        return error
+    
+    if not segment_index.remove(segment_id):
+        return jsonify({'error': 'Segment not found'}), 404
+    return jsonify({'segment_id': segment_id, 'status': 'deleted'})
+
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Report cache, fingerprint index and backend counters for this process."""
+    return jsonify({
+        'recognition_cache': recognition_cache.stats(),
+        'result_cache': result_cache.stats(),
+        'fingerprint_index': fingerprint_index.stats(),
+        'learned_index': learned_index.stats(),
+        'segment_index': segment_index.stats(),
+        'backends': recognition_router.stats(),
+        'jobs': job_queue.stats()
+    })
+
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Check which APIs are configured."""
     return jsonify({
         'audd_configured': bool(AUDD_API_TOKEN),
+        'decoder_backend': 'pyav' if decoder_pool is not None else 'subprocess',
+        'encoding_profile': ENCODING_PROFILE,
+        'learn_from_audd': LEARN_FROM_AUDD,
+        'recognition_backends': RECOGNITION_BACKENDS,
+        'hedge_after': HEDGE_AFTER or None,
+        'encoding_profiles': sorted(ENCODING_PROFILES),
         'max_file_size': '50MB',
+        'max_audio_duration': MAX_AUDIO_DURATION or None,
+        'known_segments': len(segment_index),
         'supported_formats': ['mp3', 'wav', 'm4a', 'ogg', 'flac', 'aac', 'wma', 'mp4', 'webm']
     })
 
 
 if __name__ == '__main__':
+    job_queue.start()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,365 @@
+"""
+Recognition backends behind one interface, and a router that spreads chunks
+over them.
+
+Every backend answers with an AudD-shaped response ({'status': 'success',
+'result': {...} or None}), so results can be cached, parsed and merged the
+same way whichever engine produced them. The router tries backends in order,
+hedges a slow call with the next backend and skips backends that keep
+failing until they have cooled down.
+"""
+
+import json
+import time
+import queue
+import random
+import threading
+from collections import deque
+
+LATENCY_SAMPLES = 1000  # recent calls kept per backend for latency percentiles
+
+
+def time_left(deadline: float, limit: float = None) -> float:
+    """Seconds until `deadline` (a time.monotonic() value), at most `limit`.
+    
+    Without a deadline this is `limit`, so it can be passed straight on as a
+    timeout where None means no timeout.
+    """
+    if deadline is None:
+        return limit
+    left = max(0.0, deadline - time.monotonic())
+    return left if limit is None else min(left, limit)
+
+
+def parse_audd_result(result: dict) -> dict:
+    """Parse AudD API response.
+    
+    The song length comes from the Spotify metadata, or from a 'duration' in
+    seconds for responses (like local matches) that have none.
+    """
+    if result.get('status') != 'success' or not result.get('result'):
+        return None
+    
+    track = result['result']
+    spotify = track.get('spotify') or {}
+    return {
+        'title': track.get('title', 'Unknown'),
+        'artists': [track.get('artist', 'Unknown')],
+        'album': track.get('album', 'Unknown'),
+        'release_date': track.get('release_date', 'Unknown'),
+        'label': track.get('label', 'Unknown'),
+        'duration': track.get('duration') or (spotify.get('duration_ms') or 0) / 1000,
+        'confidence': 100,
+        'spotify': track.get('spotify', {}),
+        'timecode': track.get('timecode', '')
+    }
+
+
+class Backend:
+    """A music recognition engine.
+    
+    Subclasses implement query(), returning an AudD-shaped response or
+    raising, and override parse() if their responses need it. recognize()
+    wraps query() with the per-backend stats; `cost` is charged per query.
+    Answers of backends that aren't `trusted` are never cached or learned,
+    and a miss from a backend that isn't `conclusive` only sends the chunk
+    on to the next one.
+    """
+    
+    name = 'backend'
+    trusted = True
+    conclusive = True
+    
+    def __init__(self, cost: float = 0.0):
+        self.cost = cost
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.counters = {'queries': 0, 'matches': 0, 'misses': 0, 'errors': 0, 'hedges': 0, 'latency_seconds': 0.0}
+    
+    def query(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        raise NotImplementedError
+    
+    def parse(self, response: dict) -> dict:
+        return parse_audd_result(response)
+    
+    def recognize(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        """query() a chunk, counting the outcome; the response is tagged with 'backend'.
+        
+        `hints` (such as the chunk's decoded samples) are passed on to query(),
+        which uses those it knows.
+        """
+        started = time.monotonic()
+        response = None
+        try:
+            response = self.query(audio_path, deadline, **hints)
+            return {**response, 'backend': self.name}
+        finally:
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.counters['queries'] += 1
+                self.counters['latency_seconds'] += elapsed
+                self.latencies.append(elapsed)
+                if response is None or response.get('status') != 'success':
+                    self.counters['errors'] += 1
+                elif self.parse(response) is not None:
+                    self.counters['matches'] += 1
+                else:
+                    self.counters['misses'] += 1
+    
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            latencies = sorted(self.latencies)
+        answered = stats['matches'] + stats['misses']
+        stats['hit_rate'] = round(stats['matches'] / answered, 4) if answered else None
+        stats['error_rate'] = round(stats['errors'] / stats['queries'], 4) if stats['queries'] else None
+        stats['cost'] = round(stats['queries'] * self.cost, 4)
+        stats['latency_seconds'] = round(stats['latency_seconds'], 3)
+        for name, quantile in (('latency_p50', 0.5), ('latency_p95', 0.95)):
+            stats[name] = round(latencies[int(quantile * (len(latencies) - 1))], 3) if latencies else None
+        return stats
+
+
+class AudDBackend(Backend):
+    """The AudD HTTP API.
+    
+    `session()` returns the shared requests session, and `slots` caps the
+    calls in flight across all requests. With a `deadline`, waiting for a
+    slot and the HTTP timeouts are cut to the time left.
+    """
+    
+    name = 'audd'
+    
+    def __init__(self, api_token: str, url: str, session, slots: threading.Semaphore,
+                 connect_timeout: float = 5, read_timeout: float = 30, cost: float = 0.0):
+        super().__init__(cost)
+        self.api_token = api_token
+        self.url = url
+        self.session = session
+        self.slots = slots
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+    
+    def query(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        if not self.api_token:
+            return {'error': 'AudD API token not configured'}
+        
+        if not self.slots.acquire(timeout=time_left(deadline)):
+            raise Exception("deadline exceeded")
+        try:
+            with open(audio_path, 'rb') as f:
+                data = {
+                    'api_token': self.api_token,
+                    'return': 'timecode,spotify'
+                }
+                files = {'file': f}
+                
+                if deadline is not None and time_left(deadline) <= 0:
+                    raise Exception("deadline exceeded")
+                response = self.session().post(
+                    self.url,
+                    data=data,
+                    files=files,
+                    timeout=(time_left(deadline, self.connect_timeout), time_left(deadline, self.read_timeout))
+                )
+        finally:
+            self.slots.release()
+        
+        return response.json()
+
+
+class MockBackend(Backend):
+    """An offline stand-in for development and load tests.
+    
+    Answers every query with `result` (an AudD 'result' object, or None for
+    no match) after `latency` seconds, and fails a `error_rate` fraction of
+    queries with an error response.
+    """
+    
+    name = 'mock'
+    trusted = False
+    
+    def __init__(self, result: dict = None, latency: float = 0.0, error_rate: float = 0.0, cost: float = 0.0,
+                 seed: int = None):
+        super().__init__(cost)
+        self.result = result
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+    
+    @classmethod
+    def from_json(cls, result_json: str, **kwargs) -> 'MockBackend':
+        return cls(json.loads(result_json) if result_json else None, **kwargs)
+    
+    def query(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        wait = time_left(deadline, self.latency)
+        time.sleep(wait)
+        if wait < self.latency:
+            raise Exception("deadline exceeded")
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+        if failed:
+            return {'status': 'error', 'error': {'error_code': 0, 'error_message': 'mock failure'}}
+        return {'status': 'success', 'result': self.result}
+
+
+class LocalBackend(Backend):
+    """Our own fingerprint indexes.
+    
+    `match(audio_path, deadline, **hints)` returns an AudD-shaped response
+    for a confident match, or None. The indexes only know some songs, so a
+    miss is not conclusive, and their answers aren't cached or learned.
+    """
+    
+    name = 'local'
+    trusted = False
+    conclusive = False
+    
+    def __init__(self, match, cost: float = 0.0):
+        super().__init__(cost)
+        self.match = match
+    
+    def query(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        return self.match(audio_path, deadline, **hints) or {'status': 'success', 'result': None}
+
+
+class Router:
+    """Sends each chunk to the first healthy backend, falling back down the list.
+    
+    A backend whose response is an error (or that raises) is followed by the
+    next one; a miss ends the search unless the backend isn't conclusive or
+    `escalate_misses` is set, which makes the list a chain of tiers. With `hedge_after`, a call that has not
+    answered within that many seconds is raced against the next backend and
+    the first useful answer wins. A backend that fails `failure_threshold`
+    times in a row is skipped for `cooldown` seconds (while every backend is
+    cooling down, all are tried).
+    """
+    
+    def __init__(self, backends: list, hedge_after: float = None, escalate_misses: bool = False,
+                 failure_threshold: int = 5, cooldown: float = 30.0):
+        self.backends = backends
+        self.by_name = {backend.name: backend for backend in backends}
+        self.hedge_after = hedge_after
+        self.escalate_misses = escalate_misses
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {backend.name: 0 for backend in backends}
+        self.open_until = {backend.name: 0.0 for backend in backends}
+        self.counters = {'calls': 0, 'hedged_calls': 0, 'fallbacks': 0, 'skipped_unhealthy': 0}
+    
+    def available(self) -> list:
+        """Backends in order, leaving out those cooling down (unless all are)."""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [backend for backend in self.backends if self.open_until[backend.name] <= now]
+            self.counters['skipped_unhealthy'] += len(self.backends) - len(healthy)
+        return healthy or list(self.backends)
+    
+    def record(self, backend: Backend, ok: bool):
+        with self.lock:
+            if ok:
+                self.failures[backend.name] = 0
+                return
+            self.failures[backend.name] += 1
+            if self.failures[backend.name] >= self.failure_threshold:
+                self.open_until[backend.name] = time.monotonic() + self.cooldown
+                self.failures[backend.name] = 0
+    
+    def recognize(self, audio_path: str, deadline: float = None, **hints) -> dict:
+        """An AudD-shaped response from the first backend that answers usefully.
+        
+        A match wins at once. A miss only stands once no backend ahead of it
+        in the order is still running, and with `escalate_misses` once every
+        backend has answered; an inconclusive miss only stands if no other
+        backend answered or failed. If every backend fails, the last error
+        response is returned, or the last exception raised. `hints` are
+        passed on to the backends.
+        """
+        remaining = self.available()
+        rank = {backend.name: n for n, backend in enumerate(remaining)}
+        answers = queue.Queue()
+        running = []
+        hedged = False
+        last_response, last_error, inconclusive = None, None, None
+        with self.lock:
+            self.counters['calls'] += 1
+        
+        def call(backend):
+            try:
+                answers.put((backend, backend.recognize(audio_path, deadline, **hints), None))
+            except Exception as e:
+                answers.put((backend, None, e))
+        
+        def launch():
+            backend = remaining.pop(0)
+            running.append(backend)
+            threading.Thread(target=call, args=(backend,), daemon=True).start()
+        
+        launch()
+        while running:
+            hedge = self.hedge_after if self.hedge_after and remaining and not hedged else None
+            wait = time_left(deadline, hedge)
+            try:
+                backend, response, error = answers.get(timeout=wait)
+            except queue.Empty:
+                if hedge is None or wait < hedge:
+                    raise Exception("deadline exceeded")
+                # Still waiting after hedge_after: race the next backend
+                hedged = True
+                with self.lock:
+                    self.counters['hedged_calls'] += 1
+                with remaining[0].lock:
+                    remaining[0].counters['hedges'] += 1
+                launch()
+                continue
+            running.remove(backend)
+            
+            ok = error is None and response.get('status') == 'success'
+            self.record(backend, ok)
+            if ok and backend.parse(response) is not None:
+                return response
+            if error is not None:
+                last_error = error
+            elif ok and not backend.conclusive:
+                inconclusive = inconclusive or response
+            elif (last_response is None or last_response.get('status') != 'success'
+                  or ok and rank[backend.name] < rank[last_response['backend']]):
+                # A miss is a better answer than an error, and an earlier backend's miss than a later one's
+                last_response = response
+            
+            missed = last_response is not None and last_response.get('status') == 'success'
+            if missed and not self.escalate_misses:
+                if all(rank[other.name] > rank[last_response['backend']] for other in running):
+                    return last_response
+                continue
+            
+            if not running and remaining:
+                with self.lock:
+                    self.counters['fallbacks'] += 1
+                launch()
+        
+        if last_response is not None:
+            return last_response
+        if last_error is not None:
+            raise last_error
+        return inconclusive
+    
+    def authoritative(self, response: dict) -> bool:
+        """Whether a response came from the first conclusive backend in the order and may be cached or learned from."""
+        backend = next((backend for backend in self.backends if backend.conclusive), None)
+        return backend is not None and backend.trusted and response.get('backend') == backend.name
+    
+    def parse(self, response: dict) -> dict:
+        """Parse a response with the backend that produced it (AudD's parser for untagged ones)."""
+        backend = self.by_name.get(response.get('backend'))
+        return backend.parse(response) if backend is not None else parse_audd_result(response)
+    
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            stats = dict(self.counters)
+            cooling = {name: round(until - now, 1) for name, until in self.open_until.items() if until > now}
+        stats['cooling_down'] = cooling
+        stats['backends'] = {backend.name: backend.stats() for backend in self.backends}
+        return stats
@@ -0,0 +1,80 @@
+"""
+Benchmark chunks per second for the two decoder backends: ffmpeg/ffprobe
+subprocesses per call, and the in-process PyAV pool (decoder.DecoderPool)
+that keeps the input open between chunk requests. Measures duration probes
+(when ffprobe is installed) and per-chunk extraction to MP3.
+
+Usage: python benchmarks/bench_decoders.py --minutes 30 --chunks 24 --workers 4
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import decoder  # noqa: E402
+from bench_extraction import make_input  # noqa: E402
+
+
+def rate(calls: list, workers: int) -> float:
+    """Calls per second when running calls on a pool of workers."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(call) for call in calls]:
+            future.result()
+    return len(calls) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, default=30)
+    parser.add_argument('--chunks', type=int, default=24, help='chunks per measurement, spread over the input')
+    parser.add_argument('--workers', type=int, default=app.EXTRACT_WORKERS)
+    args = parser.parse_args()
+    
+    if not decoder.available():
+        sys.exit("PyAV is not installed (pip install av); nothing to compare")
+    
+    # Swap in a pool sized to --workers for the in-process runs
+    app.decoder_pool = decoder.DecoderPool(args.workers)
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        audio_path = os.path.join(work_dir, 'input.mp3')
+        make_input(audio_path, args.minutes * 60)
+        last_start = args.minutes * 60 - app.CHUNK_DURATION
+        starts = [last_start * n / max(args.chunks - 1, 1) for n in range(args.chunks)]
+        
+        def output(n):
+            return os.path.join(work_dir, f'chunk_{n}.mp3')
+        
+        def extract(in_process):
+            return [lambda n=n, s=s: app.extract_audio_chunk(audio_path, s, app.CHUNK_DURATION, output(n),
+                                                             in_process=in_process)
+                    for n, s in enumerate(starts)]
+        
+        cases = []
+        if shutil.which('ffprobe'):
+            cases.append(('duration probe',
+                          [lambda: app.ffprobe_duration(audio_path)] * args.chunks,
+                          [lambda: app.decoder_pool.duration(audio_path)] * args.chunks))
+        cases.append(('chunk extract', extract(False), extract(True)))
+        
+        print(f"{'operation':<15} {'subprocess/s':>13} {'pyav/s':>9} {'speedup':>8}")
+        for name, spawned, in_process in cases:
+            slow = rate(spawned, args.workers)
+            fast = rate(in_process, args.workers)
+            print(f"{name:<15} {slow:>13.1f} {fast:>9.1f} {fast / slow:>7.1f}x")
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark chunk extraction: one ffmpeg seek+decode per chunk versus the
+single-pass segmenter and the mmap'd PCM buffer, which both decode the
+upload once.
+
+Usage: python benchmarks/bench_extraction.py --minutes 30 60 120
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def make_input(path: str, seconds: float):
+    """Render a synthetic stereo MP3 of the given length."""
+    cmd = [
+        'ffmpeg',
+        '-y',
+        '-v', 'error',
+        '-f', 'lavfi',
+        '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}',
+        '-ac', '2',
+        '-b:a', '192k',
+        path
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def run_per_chunk(audio_path: str, chunks: list, out_dir: str) -> float:
+    started = time.perf_counter()
+    for i, (start_time, chunk_duration) in enumerate(chunks):
+        app.extract_audio_chunk(audio_path, start_time, chunk_duration, os.path.join(out_dir, f'chunk_{i}.mp3'))
+    return time.perf_counter() - started
+
+
+def run_single_pass(audio_path: str, chunks: list, out_dir: str) -> float:
+    started = time.perf_counter()
+    for i, _, _, pcm in app.iter_pcm_windows(audio_path, chunks):
+        app.encode_pcm_chunk(pcm, os.path.join(out_dir, f'chunk_{i}.mp3'))
+    return time.perf_counter() - started
+
+
+def run_pcm_buffer(audio_path: str, chunks: list, out_dir: str) -> float:
+    started = time.perf_counter()
+    with app.PCMBuffer(audio_path, out_dir) as pcm_buffer:
+        for i, (start_time, chunk_duration) in enumerate(chunks):
+            app.encode_pcm_chunk(pcm_buffer.window(start_time, chunk_duration), os.path.join(out_dir, f'chunk_{i}.mp3'))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, nargs='+', default=[10, 30, 60])
+    parser.add_argument('--skip-per-chunk-over', type=float, default=None,
+                        help='skip the per-chunk path for inputs longer than this many minutes')
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'minutes':>8} {'chunks':>7} {'per_chunk s':>12} {'single_pass s':>14} {'pcm_buffer s':>13} {'speedup':>8}")
+        for minutes in args.minutes:
+            audio_path = os.path.join(work_dir, f'input_{minutes:g}.mp3')
+            make_input(audio_path, minutes * 60)
+            chunks = app.plan_chunks(minutes * 60)
+            
+            per_chunk = None
+            if args.skip_per_chunk_over is None or minutes <= args.skip_per_chunk_over:
+                out_dir = tempfile.mkdtemp(dir=work_dir)
+                per_chunk = run_per_chunk(audio_path, chunks, out_dir)
+                shutil.rmtree(out_dir)
+            
+            out_dir = tempfile.mkdtemp(dir=work_dir)
+            single_pass = run_single_pass(audio_path, chunks, out_dir)
+            shutil.rmtree(out_dir)
+            
+            out_dir = tempfile.mkdtemp(dir=work_dir)
+            pcm_buffer = run_pcm_buffer(audio_path, chunks, out_dir)
+            shutil.rmtree(out_dir)
+            
+            if per_chunk is None:
+                print(f"{minutes:>8g} {len(chunks):>7} {'-':>12} {single_pass:>14.2f} {pcm_buffer:>13.2f} {'-':>8}")
+            else:
+                speedup = per_chunk / min(single_pass, pcm_buffer)
+                print(f"{minutes:>8g} {len(chunks):>7} {per_chunk:>12.2f} {single_pass:>14.2f} {pcm_buffer:>13.2f} {speedup:>7.1f}x")
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark the local fingerprint engine on synthetic mixes: random note
+sequences are indexed as reference tracks, then chunk-length excerpts are
+mixed with speech-like noise at several signal-to-noise ratios and matched.
+Excerpts of tracks that were never indexed measure false positives. Audio is
+synthesized at the analysis rate, so no codec is involved.
+
+Usage: python benchmarks/bench_fingerprint.py --tracks 50 --seconds 120 --queries 100 --snr 10 0 -5
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from fingerprint import FingerprintIndex  # noqa: E402
+
+RATE = app.ANALYSIS_SAMPLE_RATE
+
+
+def synth_track(seed: int, seconds: float) -> np.ndarray:
+    """A random melody of decaying harmonic notes, as float samples in [-1, 1]."""
+    rng = np.random.default_rng(seed)
+    note_seconds = rng.choice([0.125, 0.25, 0.5])
+    note = np.arange(int(note_seconds * RATE)) / RATE
+    out = np.zeros(int(seconds * RATE))
+    
+    for start in range(0, len(out) - len(note), len(note)):
+        frequency = 110 * 2 ** (rng.integers(0, 48) / 12)
+        tone = sum(np.sin(2 * np.pi * frequency * h * note) / h for h in (1, 2, 3) if frequency * h < RATE / 2)
+        out[start:start + len(note)] = tone * np.exp(-4 * note)
+    return out / np.abs(out).max()
+
+
+def speech_noise(rng, length: int) -> np.ndarray:
+    """Low-passed noise gated by a syllable-rate envelope."""
+    noise = np.convolve(rng.normal(size=length), np.ones(4) / 4, mode='same')
+    envelope = np.repeat(rng.random(length // (RATE // 5) + 1) > 0.4, RATE // 5)[:length]
+    return noise * envelope
+
+
+def mix(signal: np.ndarray, noise: np.ndarray, snr_db: float) -> np.ndarray:
+    gain = np.sqrt(np.mean(signal ** 2) / max(np.mean(noise ** 2), 1e-12) / 10 ** (snr_db / 10))
+    mixed = signal + gain * noise
+    return (mixed / np.abs(mixed).max() * 20000).astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=120, help='length of each reference track')
+    parser.add_argument('--queries', type=int, default=100, help='queries per SNR, half of them unindexed')
+    parser.add_argument('--snr', type=float, nargs='+', default=[10, 0, -5])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(args.seed)
+    tracks = [synth_track(args.seed * 100000 + n, args.seconds) for n in range(args.tracks)]
+    unindexed = [synth_track(args.seed * 100000 + args.tracks + n, args.seconds) for n in range(args.tracks)]
+    chunk = int(app.CHUNK_DURATION * RATE)
+    
+    index = FingerprintIndex(None, rate=RATE)
+    started = time.perf_counter()
+    for n, track in enumerate(tracks):
+        index.add((track * 20000).astype(np.int16), {'title': f'track {n}'})
+    build = time.perf_counter() - started
+    print(f"indexed {args.tracks} x {args.seconds:.0f}s in {build:.2f}s, {index.stats()['hashes']} hashes")
+    
+    print(f"{'snr dB':>7} {'recall':>7} {'offset ok':>10} {'false pos':>10} {'match ms':>9}")
+    for snr in args.snr:
+        found = offset_ok = false_positives = 0
+        elapsed = 0.0
+        positives = args.queries - args.queries // 2
+        
+        for q in range(args.queries):
+            indexed = q < positives
+            n = int(rng.integers(args.tracks))
+            start = int(rng.integers(len(tracks[n]) - chunk))
+            excerpt = (tracks if indexed else unindexed)[n][start:start + chunk]
+            query = mix(excerpt, speech_noise(rng, chunk), snr)
+            
+            began = time.perf_counter()
+            match = index.match(query)
+            elapsed += time.perf_counter() - began
+            
+            if not app.confident(match):
+                continue
+            if not indexed:
+                false_positives += 1
+            elif match['metadata']['title'] == f'track {n}':
+                found += 1
+                offset_ok += abs(match['offset'] - start / RATE) <= 0.1
+        
+        negatives = args.queries - positives
+        print(f"{snr:>7.1f} {found / positives:>7.1%} {offset_ok / max(found, 1):>10.1%} "
+              f"{false_positives / max(negatives, 1):>10.1%} {elapsed / args.queries * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
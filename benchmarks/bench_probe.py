@@ -0,0 +1,100 @@
+"""
+Benchmark duration probing per upload format: the pure-Python header prober
+(probe.py) against ffprobe and, when PyAV is installed, the in-process
+decoder. Also prints each prober's answer so disagreements show up.
+
+Usage: python benchmarks/bench_probe.py --minutes 10 --repeat 20
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import probe  # noqa: E402
+import decoder  # noqa: E402
+
+# file name -> ffmpeg output options
+FORMATS = {
+    'input.wav': [],
+    'input.flac': [],
+    'input.mp3': ['-b:a', '192k'],
+    'cbr_no_xing.mp3': ['-b:a', '192k', '-write_xing', '0'],
+    'vbr.mp3': ['-q:a', '4'],
+    'faststart.m4a': ['-c:a', 'aac', '-movflags', '+faststart'],
+    'input.m4a': ['-c:a', 'aac'],
+    'vorbis.ogg': ['-c:a', 'libvorbis'],
+    'opus.ogg': ['-c:a', 'libopus'],
+    'input.webm': ['-c:a', 'libopus'],
+}
+
+
+def make_format(path: str, seconds: float, options: list) -> bool:
+    cmd = [
+        'ffmpeg',
+        '-y',
+        '-v', 'error',
+        '-f', 'lavfi',
+        '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}',
+        '-ac', '2',
+        *options,
+        path
+    ]
+    return subprocess.run(cmd, capture_output=True).returncode == 0
+
+
+def time_probe(fn, path: str, repeat: int) -> tuple:
+    """(best time in microseconds, duration) for fn(path), or (None, None) if it fails."""
+    best = None
+    duration = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        try:
+            duration = fn(path)
+        except Exception:
+            return None, None
+        elapsed = (time.perf_counter() - started) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, default=10)
+    parser.add_argument('--repeat', type=int, default=20, help='best-of runs per measurement')
+    args = parser.parse_args()
+    
+    probers = [('header', probe.file_duration)]
+    if shutil.which('ffprobe'):
+        probers.append(('ffprobe', app.ffprobe_duration))
+    if decoder.available():
+        pool = decoder.DecoderPool(1)
+        probers.append(('pyav', pool.duration))
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'file':<16}" + ''.join(f" {name + ' us':>12} {name + ' s':>12}" for name, _ in probers))
+        for name, options in FORMATS.items():
+            path = os.path.join(work_dir, name)
+            if not make_format(path, args.minutes * 60, options):
+                print(f"{name:<16} (encoder not available)")
+                continue
+            
+            row = f"{name:<16}"
+            for _, fn in probers:
+                elapsed, duration = time_probe(fn, path, args.repeat)
+                row += f" {'-':>12} {'-':>12}" if duration is None else f" {elapsed:>12.0f} {duration:>12.3f}"
+            print(row)
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
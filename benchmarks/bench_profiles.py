@@ -0,0 +1,97 @@
+"""
+Benchmark the chunk encoding profiles: bytes sent per chunk, encode time and,
+against a labelled corpus, how often AudD still recognizes the right song.
+
+The corpus is a JSON list of {"path", "start", "title"} entries, one per
+chunk; "title" is null for chunks that should not match, and relative paths
+are resolved against the manifest's directory. Match rates need
+AUDD_API_TOKEN and cost one AudD query per entry and profile. Without a
+corpus a synthetic input is encoded to measure size and speed only.
+
+Usage: python benchmarks/bench_profiles.py --corpus corpus.json --profiles mp3_128k opus_24k
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from bench_extraction import make_input  # noqa: E402
+
+
+def load_corpus(manifest: str) -> list:
+    with open(manifest) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(manifest))
+    return [{**entry, 'path': os.path.join(base, entry['path'])} for entry in entries]
+
+
+def same_title(parsed: dict, title: str) -> bool:
+    if title is None:
+        return parsed is None
+    return parsed is not None and parsed['title'].casefold().strip() == title.casefold().strip()
+
+
+def run_profile(profile: str, entries: list, work_dir: str, recognize: bool) -> dict:
+    output_path = os.path.join(work_dir, f"chunk{app.ENCODING_PROFILES[profile]['extension']}")
+    sizes, times, correct, errors = [], [], 0, 0
+    
+    for entry in entries:
+        started = time.perf_counter()
+        app.extract_audio_chunk(entry['path'], entry['start'], app.CHUNK_DURATION, output_path,
+                                encoding_profile=profile)
+        times.append(time.perf_counter() - started)
+        sizes.append(os.path.getsize(output_path))
+        
+        if recognize:
+            result = app.recognize_with_audd(output_path)
+            if result.get('status') != 'success':
+                errors += 1
+            correct += same_title(app.parse_audd_result(result), entry.get('title'))
+    
+    return {
+        'bytes': sum(sizes) / len(sizes),
+        'encode_ms': sum(times) / len(times) * 1000,
+        'match_rate': correct / len(entries) if recognize else None,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', help='JSON manifest of labelled chunks')
+    parser.add_argument('--profiles', nargs='+', default=sorted(app.ENCODING_PROFILES), choices=sorted(app.ENCODING_PROFILES))
+    parser.add_argument('--chunks', type=int, default=10, help='synthetic chunks to encode without a corpus')
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.corpus:
+            entries = load_corpus(args.corpus)
+        else:
+            audio_path = os.path.join(work_dir, 'input.mp3')
+            make_input(audio_path, args.chunks * app.CHUNK_DURATION)
+            entries = [{'path': audio_path, 'start': n * app.CHUNK_DURATION} for n in range(args.chunks)]
+        recognize = bool(args.corpus and app.AUDD_API_TOKEN)
+        if args.corpus and not recognize:
+            print("AUDD_API_TOKEN is not set; match rates are skipped")
+        
+        print(f"{'profile':<10} {'bytes/chunk':>12} {'kbit/s':>8} {'encode ms':>10} {'match rate':>11} {'errors':>7}")
+        for profile in args.profiles:
+            stats = run_profile(profile, entries, work_dir, recognize)
+            match_rate = f"{stats['match_rate']:.1%}" if stats['match_rate'] is not None else '-'
+            print(f"{profile:<10} {stats['bytes']:>12.0f} {stats['bytes'] * 8 / app.CHUNK_DURATION / 1000:>8.1f} "
+                  f"{stats['encode_ms']:>10.1f} {match_rate:>11} {stats['errors']:>7}")
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark per-chunk extraction latency against chunk offset, comparing
+output seeking (-ss after -i) with input seeking (-ss before -i).
+
+Usage: python benchmarks/bench_seek.py --minutes 60 --samples 8
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+from bench_extraction import make_input  # noqa: E402
+
+
+def time_extraction(audio_path: str, start_time: float, output_path: str, fast_seek: bool, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        app.extract_audio_chunk(audio_path, start_time, app.CHUNK_DURATION, output_path, fast_seek=fast_seek,
+                                in_process=False)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--minutes', type=float, default=60)
+    parser.add_argument('--samples', type=int, default=8, help='number of offsets spread over the input')
+    parser.add_argument('--repeat', type=int, default=3, help='best-of runs per measurement')
+    args = parser.parse_args()
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        audio_path = os.path.join(work_dir, 'input.mp3')
+        make_input(audio_path, args.minutes * 60)
+        output_path = os.path.join(work_dir, 'chunk.mp3')
+        
+        last_start = args.minutes * 60 - app.CHUNK_DURATION
+        offsets = [last_start * n / max(args.samples - 1, 1) for n in range(args.samples)]
+        
+        print(f"{'offset':>9} {'output seek ms':>15} {'input seek ms':>14} {'speedup':>8}")
+        for offset in offsets:
+            slow = time_extraction(audio_path, offset, output_path, False, args.repeat)
+            fast = time_extraction(audio_path, offset, output_path, True, args.repeat)
+            print(f"{app.format_timestamp(offset):>9} {slow * 1000:>15.1f} {fast * 1000:>14.1f} {slow / fast:>7.1f}x")
+    
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
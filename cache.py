@@ -0,0 +1,120 @@
+"""
+Two-tier cache for JSON-serializable results.
+An in-memory LRU sits in front of an optional SQLite file with size- and
+TTL-based eviction, so entries survive restarts and are shared by workers.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Content-addressed cache with an LRU memory tier and a SQLite disk tier."""
+    
+    def __init__(self, path: str = None, memory_entries: int = 1024, max_bytes: int = 64 << 20, ttl: float = 7 * 86400):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # key -> (stored_at, value)
+        self.counters = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self.db = None
+        
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'stored_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+            self.db.commit()
+    
+    def get(self, key: str):
+        """Return the cached value for key, or None on a miss."""
+        now = time.time()
+        
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self.memory.move_to_end(key)
+                self.counters['hits'] += 1
+                self.counters['memory_hits'] += 1
+                return entry[1]
+            self.memory.pop(key, None)
+            
+            if self.db is not None:
+                row = self.db.execute(
+                    'SELECT value, stored_at FROM entries WHERE key = ? AND stored_at >= ?',
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self.db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+                    self.db.commit()
+                    value = json.loads(row[0])
+                    self.remember(key, row[1], value)
+                    self.counters['hits'] += 1
+                    self.counters['disk_hits'] += 1
+                    return value
+            
+            self.counters['misses'] += 1
+            return None
+    
+    def put(self, key: str, value):
+        """Store value under key in both tiers, evicting old entries as needed."""
+        now = time.time()
+        
+        with self.lock:
+            self.remember(key, now, value)
+            self.counters['stores'] += 1
+            
+            if self.db is not None:
+                data = json.dumps(value)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                    (key, data, len(data), now, now)
+                )
+                self.evict(now)
+                self.db.commit()
+    
+    def remember(self, key: str, stored_at: float, value):
+        self.memory[key] = (stored_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+    
+    def evict(self, now: float):
+        """Drop expired disk entries, then least recently used ones over max_bytes."""
+        expired = self.db.execute('DELETE FROM entries WHERE stored_at < ?', (now - self.ttl,)).rowcount
+        self.counters['evictions'] += expired
+        
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        rows = self.db.execute('SELECT key, size FROM entries ORDER BY accessed_at').fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.db.executemany('DELETE FROM entries WHERE key = ?', stale)
+        self.counters['evictions'] += len(stale)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self.memory)
+            if self.db is not None:
+                stats['disk_entries'], stats['disk_bytes'] = self.db.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+                ).fetchone()
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        return stats
@@ -0,0 +1,168 @@
+"""
+In-process decoding with PyAV (libav bindings), run on a persistent pool of
+worker threads that keep recently used files open between chunk requests.
+PyAV is optional; `available()` is False when it is not installed and callers
+use the ffmpeg/ffprobe subprocess path instead.
+
+Only probing and decoding happen here. MP3 encoding stays with the ffmpeg
+encoder, which benchmarked faster than PyAV's bundled libmp3lame.
+"""
+
+import os
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+try:
+    import av
+except ImportError:
+    av = None
+
+RELEASE_WAIT = 5  # seconds a worker holds a release task for the others to take theirs
+
+
+def available() -> bool:
+    return av is not None
+
+
+class DecoderPool:
+    """Decoding workers that each keep their own LRU of open containers.
+    
+    PyAV containers are not thread-safe, so a container is only ever used by
+    the worker that opened it. A file that keeps being asked for ends up open
+    in every worker, and each request after the first skips the open and the
+    codec setup.
+    """
+    
+    def __init__(self, workers: int = 2, open_files: int = 4):
+        self.workers = workers
+        self.open_files = open_files
+        self.tasks = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+    
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+    
+    def worker(self):
+        containers = OrderedDict()  # (path, inode, mtime) -> open input container
+        
+        while True:
+            fn, args, future = self.tasks.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(containers, *args))
+            except Exception as e:
+                future.set_exception(e)
+    
+    def submit(self, fn, *args) -> Future:
+        self.start()
+        future = Future()
+        self.tasks.put((fn, args, future))
+        return future
+    
+    def open(self, containers: OrderedDict, path: str):
+        """Return this worker's open container for path, opening it if needed."""
+        info = os.stat(path)
+        key = (path, info.st_ino, info.st_mtime_ns)
+        
+        container = containers.pop(key, None)
+        if container is None:
+            container = av.open(path)
+        containers[key] = container
+        
+        while len(containers) > self.open_files:
+            _, stale = containers.popitem(last=False)
+            stale.close()
+        return container
+    
+    def release(self, path: str):
+        """Have every worker close its containers for path, e.g. once the file is deleted.
+        
+        Returns without waiting for the workers to get to it.
+        """
+        with self.lock:
+            if not self.threads:
+                return
+        # One task per worker: each holds its task at the barrier until all are taken
+        barrier = threading.Barrier(self.workers)
+        for _ in range(self.workers):
+            self.submit(self._release, path, barrier)
+    
+    def duration(self, path: str, timeout: float = None) -> float:
+        """Duration of the first audio stream in seconds."""
+        return self.submit(self._duration, path).result(timeout)
+    
+    def window(self, path: str, start_time: float, duration: float, rate: int, timeout: float = None) -> bytes:
+        """Mono s16 PCM at rate for [start_time, start_time + duration) of path."""
+        return self.submit(self._window, path, start_time, duration, rate).result(timeout)
+    
+    def _duration(self, containers, path):
+        container = self.open(containers, path)
+        stream = container.streams.audio[0]
+        if stream.duration is not None:
+            return float(stream.duration * stream.time_base)
+        if container.duration is not None:
+            return container.duration / av.time_base
+        raise Exception(f"no duration in {os.path.basename(path)}")
+    
+    def _release(self, containers, path, barrier):
+        for key in [key for key in containers if key[0] == path]:
+            containers.pop(key).close()
+        try:
+            barrier.wait(RELEASE_WAIT)
+        except threading.BrokenBarrierError:
+            pass
+    
+    def _window(self, containers, path, start_time, duration, rate):
+        try:
+            return decode_window(self.open(containers, path), start_time, duration, rate)
+        except Exception:
+            # Drop the container in case the failure left it in a bad state
+            for key in [key for key in containers if key[0] == path]:
+                containers.pop(key).close()
+            raise
+
+
+def decode_window(container, start_time: float, duration: float, rate: int) -> bytes:
+    """Mono s16 PCM at rate for [start_time, start_time + duration) of the first audio stream.
+    
+    Seeks to the keyframe at or before start_time, then trims the decoded audio
+    to the window using the timestamp of the first frame after the seek.
+    """
+    stream = container.streams.audio[0]
+    container.seek(max(0, int(start_time / stream.time_base)), stream=stream, backward=True)
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=rate)
+    
+    first = int(start_time * rate)
+    wanted = int(duration * rate)
+    origin = None  # sample position of the first decoded sample
+    pieces = []
+    decoded = 0
+    
+    for frame in container.decode(stream):
+        if origin is None:
+            frame_time = float(frame.pts * stream.time_base) if frame.pts is not None else start_time
+            origin = int(frame_time * rate)
+        for resampled in resampler.resample(frame):
+            samples = resampled.to_ndarray().reshape(-1)
+            pieces.append(samples)
+            decoded += len(samples)
+        if origin + decoded >= first + wanted:
+            break
+    
+    if origin is None:
+        return b''
+    pcm = np.concatenate(pieces) if pieces else np.empty(0, dtype=np.int16)
+    skip = max(0, first - origin)
+    return pcm[skip:skip + wanted].astype(np.int16).tobytes()
+
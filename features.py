@@ -0,0 +1,272 @@
+"""
+Cheap NumPy analysis of decoded audio, used to decide which chunks are worth
+sending for recognition.
+"""
+
+import warnings
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FRAME_DURATION = 0.5  # seconds per analysis frame
+
+
+def full_scale(samples: np.ndarray) -> float:
+    """Amplitude of a full-scale sample: 32768 for int16 PCM, 1.0 for floats."""
+    return float(-np.iinfo(samples.dtype).min) if samples.dtype.kind == 'i' else 1.0
+
+
+def frame_rms_db(samples: np.ndarray, sample_rate: int, frame_duration: float = FRAME_DURATION) -> np.ndarray:
+    """RMS level of consecutive frames in dBFS."""
+    frame = max(1, int(sample_rate * frame_duration))
+    count = len(samples) // frame
+    frames = samples[:count * frame].reshape(count, frame)
+    # einsum accumulates in float64 without materialising a converted copy
+    energy = np.einsum('ij,ij->i', frames, frames, dtype=np.float64)
+    power = energy / (frame * full_scale(samples) ** 2)
+    
+    with np.errstate(divide='ignore'):
+        return 10 * np.log10(power)
+
+
+def chunk_frame_windows(values: np.ndarray, chunks: list, fill: float, frame_duration: float = FRAME_DURATION) -> np.ndarray:
+    """Gather per-frame values into one row per (start_time, duration) chunk.
+    
+    Rows are as wide as the longest chunk; frames past a chunk's end or past the
+    end of the analysed audio are set to `fill`.
+    """
+    starts = np.array([start for start, _ in chunks], dtype=np.float64)
+    ends = starts + np.array([duration for _, duration in chunks], dtype=np.float64)
+    first = np.floor(starts / frame_duration).astype(int)
+    last = np.maximum(np.ceil(ends / frame_duration).astype(int), first + 1)
+    width = int((last - first).max())
+    
+    pad = max(0, int(first.max()) + width - len(values))
+    padded = np.concatenate([values, np.full(pad, fill)])
+    rows = sliding_window_view(padded, width)[first]
+    return np.where(np.arange(width) < (last - first)[:, None], rows, fill)
+
+
+def chunk_peak_levels(samples: np.ndarray, sample_rate: int, chunks: list) -> np.ndarray:
+    """Loudest frame level (dBFS) inside each chunk.
+    
+    A chunk is only as quiet as its loudest half second, so a chunk that holds
+    a few seconds of music after dead air is never considered silent.
+    """
+    if not chunks:
+        return np.empty(0)
+    
+    levels = frame_rms_db(samples, sample_rate)
+    return chunk_frame_windows(levels, chunks, -np.inf).max(axis=1)
+
+
+SPECTRAL_FRAME = 512  # samples per spectral analysis frame (64 ms at 8 kHz)
+SPECTRAL_BLOCK = 4096  # frames transformed per NumPy batch to bound memory
+PITCH_RANGE = (80.0, 800.0)  # Hz searched for a harmonic autocorrelation peak
+
+
+def spectral_frame_features(samples: np.ndarray, sample_rate: int) -> dict:
+    """Per-frame level, zero-crossing rate, spectral flux and harmonicity.
+    
+    Frames are SPECTRAL_FRAME samples long and do not overlap. Harmonicity is
+    the height of the strongest autocorrelation peak in PITCH_RANGE relative to
+    the frame energy, so sustained pitched sound scores near 1 and noise near 0.
+    """
+    count = len(samples) // SPECTRAL_FRAME
+    frames = samples[:count * SPECTRAL_FRAME].reshape(count, SPECTRAL_FRAME)
+    scale = full_scale(samples)
+    window = np.hanning(SPECTRAL_FRAME).astype(np.float32)
+    lag_lo = int(sample_rate / PITCH_RANGE[1])
+    lag_hi = min(int(sample_rate / PITCH_RANGE[0]), SPECTRAL_FRAME - 1)
+    
+    level = np.empty(count)
+    zcr = np.empty(count)
+    flux = np.empty(count)
+    harmonicity = np.empty(count)
+    previous = None
+    
+    for first in range(0, count, SPECTRAL_BLOCK):
+        block = frames[first:first + SPECTRAL_BLOCK].astype(np.float32) / scale
+        rows = slice(first, first + len(block))
+        
+        power = np.mean(block * block, axis=1)
+        with np.errstate(divide='ignore'):
+            level[rows] = 10 * np.log10(power)
+        zcr[rows] = np.mean(np.signbit(block[:, 1:]) != np.signbit(block[:, :-1]), axis=1)
+        
+        # One zero-padded transform serves both the spectrum and the autocorrelation
+        spectrum = np.abs(np.fft.rfft(block * window, n=2 * SPECTRAL_FRAME, axis=1))
+        norm = spectrum / np.maximum(np.linalg.norm(spectrum, axis=1, keepdims=True), 1e-9)
+        shifted = np.vstack([norm[:1] if previous is None else previous, norm[:-1]])
+        flux[rows] = np.linalg.norm(norm - shifted, axis=1)
+        previous = norm[-1:]
+        
+        autocorr = np.fft.irfft(spectrum * spectrum, axis=1)[:, :SPECTRAL_FRAME]
+        harmonicity[rows] = autocorr[:, lag_lo:lag_hi].max(axis=1) / np.maximum(autocorr[:, 0], 1e-12)
+    
+    return {'level_db': level, 'zcr': zcr, 'flux': flux, 'harmonicity': np.clip(harmonicity, 0, 1)}
+
+
+def music_scores(samples: np.ndarray, sample_rate: int, chunks: list, floor_db: float = -50.0) -> np.ndarray:
+    """Score each (start_time, duration) chunk for music likelihood in [0, 1].
+    
+    Speech alternates syllables with pauses that drop far below the talking
+    level, and its spectrum changes from frame to frame. Music, including a bed
+    under a voice, keeps the level up between phrases and is steadier and often
+    more harmonic. Each cue is centred on a speech/music midpoint, clipped so
+    no single cue dominates, summed and squashed with a logistic: near 0 is
+    clear speech, near 1 clear music. Frames below floor_db are left out of the
+    spectral cues, and a chunk with no audible frames scores 0.
+    """
+    if not chunks:
+        return np.empty(0)
+    
+    frame_duration = SPECTRAL_FRAME / sample_rate
+    features = spectral_frame_features(samples, sample_rate)
+    level = chunk_frame_windows(features['level_db'], chunks, np.nan, frame_duration)
+    audible = level >= floor_db
+    
+    def audible_only(name):
+        values = chunk_frame_windows(features[name], chunks, np.nan, frame_duration)
+        return np.where(audible, values, np.nan)
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        
+        # How far pauses fall below the typical level, counting silent frames
+        floored = np.where(np.isnan(level), np.nan, np.maximum(level, floor_db - 70))
+        dip = np.nanpercentile(floored, 50, axis=1) - np.nanpercentile(floored, 10, axis=1)
+        # Fraction of audible frames more than 6 dB below the chunk's mean level
+        mean_level = np.nanmean(np.where(audible, level, np.nan), axis=1, keepdims=True)
+        low_energy = np.nanmean(np.where(audible, level < mean_level - 6, np.nan), axis=1)
+        zcr = audible_only('zcr')
+        zcr_variation = np.nanstd(zcr, axis=1) / np.maximum(np.nanmean(zcr, axis=1), 1e-6)
+        flux = np.nanmean(audible_only('flux'), axis=1)
+        harmonicity = np.nanmean(audible_only('harmonicity'), axis=1)
+        
+        cues = np.stack([
+            (12 - dip) / 4,
+            (0.12 - low_energy) / 0.06,
+            (0.85 - flux) / 0.1,
+            (0.7 - zcr_variation) / 0.3,
+            # Sustained pitch is strong evidence of music; its absence is not
+            # evidence of speech (drums, noise), so this cue only adds
+            np.maximum((harmonicity - 0.6) / 0.1, 0)
+        ])
+        evidence = np.nansum(np.clip(cues, -3, 3), axis=0)
+    
+    scores = 1 / (1 + np.exp(-evidence))
+    return np.where(audible.any(axis=1), scores, 0.0)
+
+
+CHROMA_FRAME = 4096  # samples per chroma frame (512 ms at 8 kHz)
+CHROMA_RANGE = (110.0, 2000.0)  # Hz folded into pitch classes
+CHROMA_SMOOTHING = 4  # frames averaged before repeats are compared
+
+
+def chroma_features(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Per-frame square root of each of the 12 pitch classes' share of the energy.
+    
+    Frames are CHROMA_FRAME samples long and do not overlap. Every row has
+    unit length whatever the loudness, and silent frames are spread evenly
+    over all classes. Returns an array of shape (frames, 12).
+    """
+    count = len(samples) // CHROMA_FRAME
+    frames = samples[:count * CHROMA_FRAME].reshape(count, CHROMA_FRAME)
+    scale = full_scale(samples)
+    window = np.hanning(CHROMA_FRAME).astype(np.float32)
+    
+    frequencies = np.fft.rfftfreq(CHROMA_FRAME, 1 / sample_rate)
+    band = (frequencies >= CHROMA_RANGE[0]) & (frequencies <= min(CHROMA_RANGE[1], sample_rate / 2))
+    pitch_class = np.round(12 * np.log2(frequencies[band] / 440)).astype(int) % 12
+    folding = np.zeros((int(band.sum()), 12), dtype=np.float32)
+    folding[np.arange(len(pitch_class)), pitch_class] = 1
+    
+    chroma = np.empty((count, 12), dtype=np.float32)
+    for first in range(0, count, SPECTRAL_BLOCK):
+        block = frames[first:first + SPECTRAL_BLOCK].astype(np.float32) / scale
+        energy = (np.abs(np.fft.rfft(block * window, axis=1)[:, band]) ** 2) @ folding
+        total = energy.sum(axis=1, keepdims=True)
+        share = np.where(total > 1e-9, energy / np.maximum(total, 1e-9), 1 / 12)
+        chroma[first:first + len(block)] = np.sqrt(share)
+    return chroma
+
+
+def repeat_clusters(samples: np.ndarray, sample_rate: int, chunks: list, candidates=None,
+                    min_similarity: float = 0.8, max_lag: float = 4.0, min_variation: float = 0.04) -> dict:
+    """Find chunks whose audio repeats that of an earlier chunk in the same file.
+    
+    Each chunk is compared with every other chunk shifted by up to `max_lag`
+    seconds either way, so a repeat need not line up with the chunk grid. The
+    similarity is the correlation of the two chroma sequences after removing
+    each pitch class's mean, so only the way the harmony moves counts, not the
+    key. Windows that overlap in time are never compared, and neither are
+    windows whose chroma hardly changes (RMS deviation under `min_variation`),
+    such as noise, silence or a drone, which would line up with anything
+    that is just as flat. Similar chunks are clustered transitively, and only
+    chunks in `candidates` (all by default) that span the full chunk length
+    take part.
+    
+    Returns {chunk index: (index of the cluster's first chunk, similarity to
+    the closest chunk in the cluster)} for every chunk but the first of each
+    cluster.
+    """
+    frame_duration = CHROMA_FRAME / sample_rate
+    indices = range(len(chunks)) if candidates is None else sorted(candidates)
+    width = int(max((duration for _, duration in chunks), default=0) / frame_duration)
+    chroma = chroma_features(samples, sample_rate)
+    if not width or len(chroma) < CHROMA_SMOOTHING + width:
+        # Too short for a single smoothed chunk-length window
+        return {}
+    # Averaging over a few frames lets repeats that fall between frame boundaries line up
+    chroma = sliding_window_view(chroma, CHROMA_SMOOTHING, axis=0).mean(axis=2)
+    lag = int(max_lag / frame_duration)
+    first = {i: int(round(chunks[i][0] / frame_duration)) for i in indices}
+    members = np.array([i for i in indices
+                        if width and chunks[i][1] / frame_duration >= width and first[i] + width <= len(chroma)])
+    if len(members) < 2:
+        return {}
+    starts = np.array([first[i] for i in members])
+    
+    def windows(positions):
+        """Mean-removed, unit-length chroma sequences starting at each frame position.
+        
+        Flat sequences come back as zeros, so they are similar to nothing.
+        """
+        rows = sliding_window_view(chroma, width, axis=0)[positions]  # (n, 12, width)
+        rows = rows - rows.mean(axis=2, keepdims=True)
+        rows = rows.reshape(len(positions), -1)
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        return np.where(norms >= min_variation * np.sqrt(rows.shape[1]), rows / np.maximum(norms, 1e-9), 0)
+    
+    reference = windows(starts)
+    similarity = np.full((len(members), len(members)), -1.0, dtype=np.float32)
+    for shift in range(-lag, lag + 1):
+        shifted = starts + shift
+        valid = (shifted >= 0) & (shifted + width <= len(chroma))
+        scores = reference @ windows(np.clip(shifted, 0, len(chroma) - width)).T
+        overlapping = np.abs(starts[:, None] - shifted[None, :]) < width
+        scores[overlapping | ~valid[None, :]] = -1.0
+        np.maximum(similarity, scores, out=similarity)
+    # A pair matches only if each chunk's own audio is found near the other
+    similarity = np.minimum(similarity, similarity.T)
+    
+    # Similar pairs join clusters, each led by its earliest chunk
+    leader = list(range(len(members)))
+    
+    def find(a):
+        while leader[a] != a:
+            leader[a] = leader[leader[a]]
+            a = leader[a]
+        return a
+    
+    for a, b in zip(*np.nonzero(np.triu(similarity >= min_similarity, 1))):
+        a, b = find(a), find(b)
+        leader[max(a, b)] = min(a, b)
+    
+    clusters = {}
+    for b in range(len(members)):
+        a = find(b)
+        if a != b:
+            clusters[int(members[b])] = (int(members[a]), float(similarity[b].max()))
+    return clusters
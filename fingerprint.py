@@ -0,0 +1,372 @@
+"""
+Landmark audio fingerprinting in NumPy, for recognizing tracks from a local
+reference catalogue, or from songs recognized before, without a network call.
+
+Spectrogram peaks are paired into (f1, f2, dt) landmark hashes. A query
+matches a reference when many of its hashes agree on the same time offset
+into that reference. The index keeps each track's hashes in SQLite and
+searches one sorted in-memory array of all of them.
+"""
+
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FFT_SIZE = 512  # samples per STFT frame
+HOP_SIZE = 256  # samples between frames (32 ms at 8 kHz)
+PEAK_NEIGHBOURHOOD = (15, 11)  # (frames, bins) a peak must be the maximum of
+PEAKS_PER_SECOND = 30  # strongest peaks kept per second of audio
+FAN_OUT = 5  # targets paired with each anchor peak
+MAX_PAIR_FRAMES = 63  # furthest target, in frames after the anchor (fits 6 bits)
+MAX_PAIR_BINS = 64  # largest frequency difference between anchor and target
+MAX_POSTINGS = 2000  # hashes more common than this in the index are ignored at query time
+
+
+def spectrogram(samples: np.ndarray) -> np.ndarray:
+    """Log-magnitude STFT, one row per frame."""
+    samples = samples.astype(np.float32)
+    if len(samples) < FFT_SIZE:
+        return np.empty((0, FFT_SIZE // 2 + 1), dtype=np.float32)
+    frames = sliding_window_view(samples, FFT_SIZE)[::HOP_SIZE]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE).astype(np.float32), axis=1))
+    return np.log(spectrum + 1e-3)
+
+
+def max_filter(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """Running maximum over `size` neighbours (centred) along one axis."""
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    padded = np.moveaxis(np.pad(values, pad, constant_values=-np.inf), axis, 0)
+    
+    # Maxima of doubling widths, then two overlapping windows cover `size`
+    width = 1
+    while width * 2 <= size:
+        padded = np.maximum(padded[:-width], padded[width:])
+        width *= 2
+    count = values.shape[axis]
+    return np.moveaxis(np.maximum(padded[:count], padded[size - width:size - width + count]), 0, axis)
+
+
+def find_peaks(spec: np.ndarray, rate: int) -> tuple:
+    """(frames, bins) of the spectrogram's local maxima, strongest PEAKS_PER_SECOND per second."""
+    if not len(spec):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    neighbourhood = max_filter(max_filter(spec, PEAK_NEIGHBOURHOOD[0], 0), PEAK_NEIGHBOURHOOD[1], 1)
+    # Peaks must stand out from the frame's own level, so flat noise and silence add none
+    floor = np.median(spec, axis=1, keepdims=True) + 1.0
+    frames, bins = np.nonzero((spec == neighbourhood) & (spec > floor))
+    
+    # Thin to the strongest peaks in each one-second block
+    block_frames = max(1, rate // HOP_SIZE)
+    strength = spec[frames, bins]
+    order = np.lexsort((-strength, frames // block_frames))
+    frames, bins = frames[order], bins[order]
+    blocks = frames // block_frames
+    rank = np.arange(len(blocks)) - np.searchsorted(blocks, blocks)
+    keep = rank < PEAKS_PER_SECOND
+    frames, bins = frames[keep], bins[keep]
+    
+    order = np.lexsort((bins, frames))
+    return frames[order], bins[order]
+
+
+def fingerprint(samples: np.ndarray, rate: int) -> tuple:
+    """Landmark hashes of mono audio and the frame of each hash's anchor peak.
+    
+    Each anchor is paired with the next FAN_OUT peaks within MAX_PAIR_FRAMES
+    frames and MAX_PAIR_BINS bins, and the pair is packed as f1 (9 bits),
+    f2 (9 bits) and dt (6 bits).
+    """
+    frames, bins = find_peaks(spectrogram(samples), rate)
+    hashes, anchors = [], []
+    paired = np.zeros(len(frames), dtype=np.int64)
+    
+    # Peaks are time-ordered, so targets are found by looking a bounded number of peaks ahead
+    for step in range(1, FAN_OUT * 4 + 1):
+        if step >= len(frames):
+            break
+        dt = frames[step:] - frames[:-step]
+        df = bins[step:] - bins[:-step]
+        ok = (dt > 0) & (dt <= MAX_PAIR_FRAMES) & (np.abs(df) <= MAX_PAIR_BINS) & (paired[:-step] < FAN_OUT)
+        anchor = np.nonzero(ok)[0]
+        paired[anchor] += 1
+        hashes.append((bins[anchor] << 15) | (bins[anchor + step] << 6) | dt[anchor])
+        anchors.append(frames[anchor])
+    
+    if not hashes:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int32)
+    return np.concatenate(hashes).astype(np.uint32), np.concatenate(anchors).astype(np.int32)
+
+
+class FingerprintIndex:
+    """Tracks' landmark hashes, persisted in SQLite and searched in memory.
+    
+    Track metadata is a free-form JSON-serializable dict (title, artist, ...).
+    Matching works on a snapshot of the sorted hash arrays, so lookups never
+    wait for tracks being added or removed.
+    
+    With `max_tracks`, the index is a cache: each track has a use score that
+    grows by one per add or hit and halves every `half_life` seconds, and the
+    track with the lowest score is evicted when the index is full.
+    """
+    
+    def __init__(self, path: str = None, rate: int = 8000, max_tracks: int = None, half_life: float = 7 * 86400):
+        self.path = path
+        self.rate = rate
+        self.max_tracks = max_tracks
+        self.half_life = half_life
+        self.lock = threading.Lock()
+        self.tracks = {}  # track id -> metadata (with 'duration' in seconds)
+        self.postings = {}  # track id -> (hashes, anchor frames)
+        self.keys = {}  # caller's identity -> track id
+        self.usage = {}  # track id -> [hits, use score, time the score was last updated]
+        self.table = self.build({})
+        self.digest = None  # revision(), until the tracks change
+        self.counters = {'queries': 0, 'hits': 0, 'adds': 0, 'evictions': 0, 'query_seconds': 0.0}
+        self.db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS tracks ('
+            'id INTEGER PRIMARY KEY, metadata TEXT NOT NULL, hashes BLOB NOT NULL, anchors BLOB NOT NULL, '
+            'added_at REAL NOT NULL)'
+        )
+        # Columns added after the first release of the table
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(tracks)')}
+        for column, definition in (('key', 'TEXT'), ('hits', 'INTEGER NOT NULL DEFAULT 0'),
+                                   ('score', 'REAL NOT NULL DEFAULT 0'), ('used_at', 'REAL NOT NULL DEFAULT 0')):
+            if column not in columns:
+                self.db.execute(f'ALTER TABLE tracks ADD COLUMN {column} {definition}')
+        self.db.execute('CREATE UNIQUE INDEX IF NOT EXISTS tracks_key ON tracks (key)')
+        self.db.commit()
+        self.load()
+    
+    def load(self):
+        with self.lock:
+            rows = self.db.execute('SELECT id, metadata, hashes, anchors, key, hits, score, used_at FROM tracks')
+            for track_id, metadata, hashes, anchors, key, hits, score, used_at in rows:
+                self.tracks[track_id] = json.loads(metadata)
+                self.postings[track_id] = (np.frombuffer(hashes, dtype=np.uint32), np.frombuffer(anchors, dtype=np.int32))
+                self.usage[track_id] = [hits, score, used_at]
+                if key is not None:
+                    self.keys[key] = track_id
+            self.table = self.build(self.postings)
+    
+    @staticmethod
+    def build(postings: dict) -> tuple:
+        """Sorted (hashes, track ids, anchor frames) over every track."""
+        if not postings:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32)
+        hashes = np.concatenate([h for h, _ in postings.values()])
+        tracks = np.concatenate([np.full(len(h), track_id) for track_id, (h, _) in postings.items()])
+        anchors = np.concatenate([a for _, a in postings.values()])
+        order = np.argsort(hashes, kind='stable')
+        return hashes[order], tracks[order], anchors[order]
+    
+    @staticmethod
+    def merge(table: tuple, track_id: int, hashes: np.ndarray, anchors: np.ndarray) -> tuple:
+        """The table with one track's new hashes inserted, without re-sorting the rest."""
+        order = np.argsort(hashes, kind='stable')
+        hashes, anchors = hashes[order], anchors[order]
+        at = np.searchsorted(table[0], hashes, side='right')
+        return (np.insert(table[0], at, hashes), np.insert(table[1], at, track_id),
+                np.insert(table[2], at, anchors))
+    
+    def decayed(self, track_id: int, now: float) -> float:
+        hits, score, used_at = self.usage[track_id]
+        return score * 0.5 ** (max(0.0, now - used_at) / self.half_life)
+    
+    def add(self, samples: np.ndarray, metadata: dict, key: str = None, offset: float = 0.0) -> int:
+        """Fingerprint a recording at the index's rate and return its track id.
+        
+        With a `key` already in the index, the hashes are added to that track
+        instead of creating a new one (its metadata is kept). `offset` is where
+        the recording starts within the track, in seconds, so that excerpts of
+        one track line up.
+        """
+        hashes, anchors = fingerprint(samples, self.rate)
+        anchors = anchors + np.int32(round(offset * self.rate / HOP_SIZE))
+        now = time.time()
+        
+        with self.lock:
+            track_id = self.keys.get(key) if key is not None else None
+            if track_id is None:
+                metadata = {'duration': len(samples) / self.rate, **metadata}
+                track_id = self.db.execute(
+                    'INSERT INTO tracks (metadata, hashes, anchors, added_at, key, hits, score, used_at) '
+                    'VALUES (?, ?, ?, ?, ?, 0, 1, ?)',
+                    (json.dumps(metadata), hashes.tobytes(), anchors.tobytes(), now, key, now)
+                ).lastrowid
+                self.tracks[track_id] = metadata
+                self.postings[track_id] = (hashes, anchors)
+                self.usage[track_id] = [0, 1.0, now]
+                if key is not None:
+                    self.keys[key] = track_id
+            else:
+                old_hashes, old_anchors = self.postings[track_id]
+                self.postings[track_id] = (np.concatenate([old_hashes, hashes]), np.concatenate([old_anchors, anchors]))
+                self.touch(track_id, now, hit=False)
+                self.db.execute(
+                    'UPDATE tracks SET hashes = ?, anchors = ? WHERE id = ?',
+                    (self.postings[track_id][0].tobytes(), self.postings[track_id][1].tobytes(), track_id)
+                )
+            self.table = self.merge(self.table, track_id, hashes, anchors)
+            self.digest = None
+            self.counters['adds'] += 1
+            
+            if self.max_tracks is not None and len(self.tracks) > self.max_tracks:
+                self.evict(now, keep=track_id)
+            self.db.commit()
+        return track_id
+    
+    def touch(self, track_id: int, now: float, hit: bool = True):
+        """Add one use to a track's score; the caller holds the lock and commits."""
+        usage = self.usage[track_id]
+        usage[1] = self.decayed(track_id, now) + 1
+        usage[2] = now
+        usage[0] += hit
+        self.db.execute('UPDATE tracks SET hits = ?, score = ?, used_at = ? WHERE id = ?', (*usage, track_id))
+    
+    def hit(self, track_id: int):
+        """Record that a match against a track was used, for eviction and hit-rate stats."""
+        with self.lock:
+            if track_id not in self.usage:
+                return
+            self.touch(track_id, time.time())
+            self.counters['hits'] += 1
+            self.db.commit()
+    
+    def evict(self, now: float, keep: int = None):
+        """Drop the least used tracks down to max_tracks; the caller holds the lock and commits."""
+        candidates = sorted((track_id for track_id in self.tracks if track_id != keep),
+                            key=lambda track_id: self.decayed(track_id, now))
+        victims = candidates[:len(self.tracks) - self.max_tracks]
+        for track_id in victims:
+            self.forget(track_id)
+        self.counters['evictions'] += len(victims)
+        self.table = self.build(self.postings)
+    
+    def forget(self, track_id: int) -> bool:
+        """Delete a track without rebuilding the table; the caller holds the lock and commits."""
+        removed = self.db.execute('DELETE FROM tracks WHERE id = ?', (track_id,)).rowcount
+        self.digest = None
+        self.tracks.pop(track_id, None)
+        self.postings.pop(track_id, None)
+        self.usage.pop(track_id, None)
+        for key in [key for key, value in self.keys.items() if value == track_id]:
+            del self.keys[key]
+        return bool(removed)
+    
+    def remove(self, track_id: int) -> bool:
+        with self.lock:
+            removed = self.forget(track_id)
+            self.db.commit()
+            self.table = self.build(self.postings)
+        return removed
+    
+    def __len__(self) -> int:
+        return len(self.tracks)
+    
+    def revision(self) -> str:
+        """Digest of every track's metadata and hashes, for keying results that depend on the index."""
+        with self.lock:
+            if self.digest is None:
+                sha256 = hashlib.sha256()
+                for track_id in sorted(self.tracks):
+                    sha256.update(json.dumps([track_id, self.tracks[track_id]], sort_keys=True).encode())
+                    sha256.update(self.postings[track_id][0].tobytes())
+                self.digest = sha256.hexdigest()[:16]
+            return self.digest
+    
+    def match(self, samples: np.ndarray) -> dict:
+        """Best-matching track for a query, or None if nothing lines up at all.
+        
+        Returns the track id and metadata, `score` (hashes agreeing on the best
+        offset), `runner_up` (the best score of any other track), `offset`,
+        the position in seconds of the query's start within the track, and
+        `matched`, the (first, last) seconds of the query those hashes span.
+        """
+        started = time.monotonic()
+        best = self.lookup(*fingerprint(samples, self.rate))
+        
+        with self.lock:
+            self.counters['queries'] += 1
+            self.counters['query_seconds'] += time.monotonic() - started
+        return best
+    
+    def scan(self, samples: np.ndarray, window: float, step: float) -> list:
+        """Match every `window` seconds of a long recording, `step` seconds apart.
+        
+        The recording is fingerprinted once. Returns (window start in seconds,
+        match) for each window where match() would find something; offsets are
+        relative to the window's start.
+        """
+        started = time.monotonic()
+        hashes, anchors = fingerprint(samples, self.rate)
+        order = np.argsort(anchors, kind='stable')
+        hashes, anchors = hashes[order], anchors[order]
+        window_frames = max(1, int(window * self.rate / HOP_SIZE))
+        step_frames = max(1, int(step * self.rate / HOP_SIZE))
+        last = max(0, len(samples) // HOP_SIZE - window_frames)
+        
+        found = []
+        firsts = list(range(0, last + 1, step_frames))
+        for first in firsts:
+            lo, hi = np.searchsorted(anchors, [first, first + window_frames])
+            match = self.lookup(hashes[lo:hi], anchors[lo:hi] - first)
+            if match is not None:
+                found.append((first * HOP_SIZE / self.rate, match))
+        
+        with self.lock:
+            self.counters['queries'] += len(firsts)
+            self.counters['query_seconds'] += time.monotonic() - started
+        return found
+    
+    def lookup(self, hashes: np.ndarray, anchors: np.ndarray) -> dict:
+        """match() for a query that is already fingerprinted."""
+        table_hashes, table_tracks, table_anchors = self.table
+        best = None
+        
+        if len(hashes) and len(table_hashes):
+            lo = np.searchsorted(table_hashes, hashes, side='left')
+            hi = np.searchsorted(table_hashes, hashes, side='right')
+            counts = hi - lo
+            useful = (counts > 0) & (counts <= MAX_POSTINGS)
+            lo, counts, anchors = lo[useful], counts[useful], anchors[useful]
+            
+            if counts.sum():
+                # Expand every query hash into its postings
+                starts = np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                tracks = table_tracks[starts]
+                deltas = table_anchors[starts].astype(np.int64) - np.repeat(anchors, counts)
+                
+                # One vote per (track, offset) pair, packed into a single integer key
+                votes, scores = np.unique((tracks << 32) + deltas + (1 << 31), return_counts=True)
+                vote_tracks = votes >> 32
+                top = int(scores.argmax())
+                track_id, delta = int(vote_tracks[top]), int((votes[top] & 0xFFFFFFFF) - (1 << 31))
+                others = scores[vote_tracks != track_id]
+                # Where in the query the winning votes came from
+                voted = np.repeat(anchors, counts)[(tracks == track_id) & (deltas == delta)]
+                best = {
+                    'track_id': track_id,
+                    'metadata': self.tracks.get(track_id, {}),
+                    'score': int(scores[top]),
+                    'runner_up': int(others.max()) if len(others) else 0,
+                    'offset': delta * HOP_SIZE / self.rate,
+                    'matched': (int(voted.min()) * HOP_SIZE / self.rate, (int(voted.max()) + 1) * HOP_SIZE / self.rate)
+                }
+        return best
+    
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats['tracks'] = len(self.tracks)
+        stats['hashes'] = len(self.table[0])
+        stats['hit_rate'] = round(stats['hits'] / stats['queries'], 4) if stats['queries'] else None
+        stats['query_seconds'] = round(stats['query_seconds'], 3)
+        return stats
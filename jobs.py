@@ -0,0 +1,180 @@
+"""
+Persistent background jobs for analyses too long to hold an HTTP worker.
+Jobs are rows in a SQLite table, so queued work survives a restart, and a
+fixed pool of worker threads runs them outside the request handlers.
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+
+class JobQueue:
+    """SQLite-backed job table drained by a bounded pool of worker threads.
+    
+    `run(job, progress)` does the work for one job and returns its JSON-
+    serializable result; it may call progress(done, total) as it goes.
+    Several processes can share the table: a running job is leased to its
+    process, which renews the lease every `lease` / 3 seconds, and is
+    requeued only once the lease has expired.
+    """
+    
+    def __init__(self, path: str, run, workers: int = 2, max_queued: int = 100, ttl: float = 7 * 86400,
+                 lease: float = 60):
+        self.path = path
+        self.run = run
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.threads = []
+        self.last_progress = {}  # job id -> monotonic time of the last stored progress
+        # Marks the jobs this process runs; pids repeat across restarts (PID 1 in a container)
+        self.instance = uuid.uuid4().hex
+        
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, params TEXT NOT NULL, '
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL, owner TEXT, '
+            'done INTEGER NOT NULL DEFAULT 0, total INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT)'
+        )
+        columns = {row[1] for row in self.db.execute('PRAGMA table_info(jobs)')}
+        if 'heartbeat' not in columns:
+            self.db.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+        self.db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+        self.db.commit()
+    
+    def start(self):
+        """Requeue jobs whose lease has expired and start the worker and heartbeat threads."""
+        with self.lock:
+            if self.threads:
+                return
+            self.requeue_expired()
+            self.threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.workers)]
+            self.threads.append(threading.Thread(target=self.heartbeat, daemon=True))
+        
+        for thread in self.threads:
+            thread.start()
+    
+    def requeue_expired(self):
+        """Requeue running jobs whose process stopped renewing their lease (call with the lock held)."""
+        self.db.execute(
+            "UPDATE jobs SET status = 'queued', owner = NULL, heartbeat = NULL "
+            "WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+            (time.time() - self.lease,)
+        )
+        self.db.commit()
+    
+    def heartbeat(self):
+        """Renew the leases of this process's running jobs."""
+        while True:
+            time.sleep(self.lease / 3)
+            with self.lock:
+                self.db.execute("UPDATE jobs SET heartbeat = ? WHERE status = 'running' AND owner = ?",
+                                (time.time(), self.instance))
+                self.db.commit()
+    
+    def submit(self, params: dict) -> str:
+        """Queue a job and return its id, or raise if the queue is full."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        
+        with self.lock:
+            self.db.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.ttl,))
+            queued = self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                self.db.commit()
+                raise Exception(f"job queue is full ({queued} jobs waiting)")
+            
+            self.db.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(params), now)
+            )
+            self.db.commit()
+            self.wakeup.notify()
+        
+        return job_id
+    
+    def get(self, job_id: str) -> dict:
+        """Return a job's status, progress and result, or None if unknown."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT id, status, params, created_at, started_at, finished_at, done, total, result, error '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        
+        if row is None:
+            return None
+        
+        job = dict(zip(('id', 'status', 'params', 'created_at', 'started_at', 'finished_at',
+                        'done', 'total', 'result', 'error'), row))
+        job['params'] = json.loads(job['params'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+    
+    def progress(self, job_id: str, done: int, total: int):
+        """Record progress, writing to the table at most once a second per job."""
+        now = time.monotonic()
+        with self.lock:
+            if done < total and now - self.last_progress.get(job_id, 0) < 1:
+                return
+            self.last_progress[job_id] = now
+            self.db.execute('UPDATE jobs SET done = ?, total = ? WHERE id = ?', (done, total, job_id))
+            self.db.commit()
+    
+    def claim(self) -> dict:
+        """Wait for the oldest queued job and mark it running for this process."""
+        with self.lock:
+            while True:
+                row = self.db.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    # Another process sharing the table may have claimed it first
+                    now = time.time()
+                    claimed = self.db.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, heartbeat = ?, owner = ? "
+                        "WHERE id = ? AND status = 'queued'",
+                        (now, now, self.instance, row[0])
+                    ).rowcount
+                    self.db.commit()
+                    if claimed:
+                        break
+                    continue
+                # Poll as well, for jobs queued by other processes or left behind by dead ones
+                self.wakeup.wait(timeout=5)
+                self.requeue_expired()
+        
+        return self.get(row[0])
+    
+    def finish(self, job_id: str, result=None, error: str = None):
+        with self.lock:
+            self.last_progress.pop(job_id, None)
+            self.db.execute(
+                'UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, done = MAX(done, total) '
+                'WHERE id = ? AND owner = ?',
+                ('failed' if error else 'done', time.time(), json.dumps(result) if result is not None else None,
+                 error, job_id, self.instance)
+            )
+            self.db.commit()
+    
+    def worker(self):
+        while True:
+            job = self.claim()
+            try:
+                result = self.run(job, lambda done, total: self.progress(job['id'], done, total))
+            except Exception as e:
+                self.finish(job['id'], error=str(e))
+            else:
+                self.finish(job['id'], result=result)
+    
+    def stats(self) -> dict:
+        with self.lock:
+            counts = dict(self.db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return {'workers': self.workers, 'max_queued': self.max_queued, **counts}
+
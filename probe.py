@@ -0,0 +1,295 @@
+"""
+Pure-Python duration probing from container headers, so the common upload
+formats don't need an ffprobe process. Every prober returns None when the
+header is missing, unsupported or implausible, and callers then fall back
+to a full probe.
+"""
+
+import io
+import os
+import math
+import struct
+
+MAX_PLAUSIBLE_DURATION = 7 * 86400  # seconds; longer header durations are treated as corrupt
+TAIL_SIZE = 1 << 16  # bytes searched for the last Ogg page
+
+
+def file_duration(path: str) -> float:
+    """Duration in seconds declared by the file's header, or None if unknown."""
+    try:
+        with open(path, 'rb') as f:
+            return stream_duration(f, os.fstat(f.fileno()).st_size)
+    except OSError:
+        return None
+
+
+def stream_duration(f, size: int = None) -> float:
+    """Duration in seconds declared by the header of a seekable binary stream.
+    
+    `size` is the full length of the file when known. It lets an MP3 without a
+    Xing/VBRI header be timed from its bitrate, and clamps WAV data sizes, so
+    only the head of an upload needs to be in `f` for most formats.
+    """
+    try:
+        f.seek(0)
+        head = f.read(12)
+        if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+            duration = wav_duration(f, size)
+        elif head[4:8] == b'ftyp':
+            duration = mp4_duration(f)
+        elif head[:4] == b'OggS':
+            duration = ogg_duration(f, size)
+        else:
+            duration = flac_or_mp3_duration(f, size)
+    except (struct.error, IndexError, ValueError, ZeroDivisionError, OSError):
+        return None
+    
+    if duration is None or not math.isfinite(duration) or not 0 < duration <= MAX_PLAUSIBLE_DURATION:
+        return None
+    return duration
+
+
+def read_at(f, offset: int, length: int) -> bytes:
+    f.seek(offset)
+    return f.read(length)
+
+
+def wav_duration(f, size: int = None) -> float:
+    """data chunk size over the fmt chunk's byte rate."""
+    offset = 12
+    byte_rate = None
+    
+    while True:
+        header = read_at(f, offset, 8)
+        if len(header) < 8:
+            return None
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        
+        if chunk_id == b'fmt ':
+            byte_rate = struct.unpack('<I', read_at(f, offset + 16, 4))[0]
+        elif chunk_id == b'data':
+            if not byte_rate:
+                return None
+            # Streamed WAVs leave the size at 0 or 0xFFFFFFFF; trust the file length then
+            available = size - offset - 8 if size is not None else None
+            if chunk_size in (0, 0xFFFFFFFF):
+                chunk_size = available
+            elif available is not None:
+                chunk_size = min(chunk_size, available)
+            return chunk_size / byte_rate if chunk_size is not None else None
+        
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+def mp4_duration(f) -> float:
+    """mdhd of the first sound track, or mvhd when no track says it holds sound.
+    
+    Only needs the moov box, wherever it is; a head of the file that stops
+    before moov gives None.
+    """
+    moov = find_box(f, 0, None, b'moov')
+    if moov is None:
+        return None
+    
+    for trak in iter_boxes(f, *moov, b'trak'):
+        mdia = find_box(f, *trak, b'mdia')
+        if mdia is None:
+            continue
+        hdlr = find_box(f, *mdia, b'hdlr')
+        if hdlr is None or read_at(f, hdlr[0] + 8, 4) != b'soun':
+            continue
+        mdhd = find_box(f, *mdia, b'mdhd')
+        if mdhd is not None:
+            return header_box_duration(f, mdhd[0])
+    
+    mvhd = find_box(f, *moov, b'mvhd')
+    return header_box_duration(f, mvhd[0]) if mvhd is not None else None
+
+
+def iter_boxes(f, start: int, end: int, box_type: bytes = None):
+    """Yield (payload_start, payload_end) of the boxes between start and end."""
+    offset = start
+    while end is None or offset + 8 <= end:
+        header = read_at(f, offset, 16)
+        if len(header) < 8:
+            return
+        box_size, found = struct.unpack('>I4s', header[:8])
+        payload = offset + 8
+        if box_size == 1:
+            box_size = struct.unpack('>Q', header[8:16])[0]
+            payload += 8
+        elif box_size == 0:
+            # Runs to the end of the enclosing box or file
+            box_size = (end if end is not None else f.seek(0, io.SEEK_END)) - offset
+        if box_size < payload - offset:
+            return
+        
+        if box_type is None or found == box_type:
+            yield payload, offset + box_size
+        offset += box_size
+
+
+def find_box(f, start: int, end: int, box_type: bytes) -> tuple:
+    return next(iter_boxes(f, start, end, box_type), None)
+
+
+def header_box_duration(f, payload: int) -> float:
+    """Duration from an mvhd or mdhd payload (version, flags, times, timescale, duration)."""
+    version = read_at(f, payload, 1)[0]
+    if version == 1:
+        timescale, duration = struct.unpack('>IQ', read_at(f, payload + 20, 12))
+        unknown = 0xFFFFFFFFFFFFFFFF
+    else:
+        timescale, duration = struct.unpack('>II', read_at(f, payload + 12, 8))
+        unknown = 0xFFFFFFFF
+    if duration == unknown:
+        return None
+    return duration / timescale
+
+
+def ogg_duration(f, size: int = None) -> float:
+    """Granule position of the last page of the first logical stream over its sample rate."""
+    if size is None:
+        return None
+    
+    first = read_at(f, 0, 27 + 255)
+    serial = first[14:18]
+    segments = first[26]
+    packet = read_at(f, 27 + segments, 64)
+    
+    if packet[:7] == b'\x01vorbis':
+        rate = struct.unpack('<I', packet[12:16])[0]
+        pre_skip = 0
+    elif packet[:8] == b'OpusHead':
+        # Opus granules always count 48 kHz samples, after pre_skip priming samples
+        rate = 48000
+        pre_skip = struct.unpack('<H', packet[10:12])[0]
+    else:
+        return None
+    
+    tail_start = max(0, size - TAIL_SIZE)
+    tail = read_at(f, tail_start, TAIL_SIZE)
+    page = len(tail)
+    while True:
+        page = tail.rfind(b'OggS', 0, page)
+        if page < 0:
+            return None
+        if tail[page + 14:page + 18] == serial:
+            granule = struct.unpack('<q', tail[page + 6:page + 14])[0]
+            if granule >= 0:
+                return (granule - pre_skip) / rate
+
+
+def flac_or_mp3_duration(f, size: int = None) -> float:
+    """FLAC STREAMINFO, or the first MPEG audio frame's Xing/VBRI header (CBR by bitrate otherwise)."""
+    # Either may be preceded by an ID3v2 tag
+    offset = 0
+    header = read_at(f, 0, 10)
+    if header[:3] == b'ID3':
+        flags = header[5]
+        tag_size = 0
+        for byte in header[6:10]:
+            tag_size = (tag_size << 7) | (byte & 0x7F)
+        offset = 10 + tag_size + (10 if flags & 0x10 else 0)
+    
+    if read_at(f, offset, 4) == b'fLaC':
+        return flac_duration(f, offset + 4)
+    return mp3_duration(f, offset, size)
+
+
+def flac_duration(f, offset: int) -> float:
+    """Total samples over sample rate, from the STREAMINFO block that must come first."""
+    block = read_at(f, offset, 4 + 34)
+    if len(block) < 38 or block[0] & 0x7F != 0:
+        return None
+    
+    packed = int.from_bytes(block[4 + 10:4 + 18], 'big')
+    rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+    if not rate or not total_samples:
+        return None
+    return total_samples / rate
+
+
+MPEG_BITRATES = {  # kbit/s by (MPEG-1, layer) and (MPEG-2/2.5, layer), bitrate index 1-14
+    (True, 1): (32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def mpeg_frame(header: bytes) -> dict:
+    """Decode a 4-byte MPEG audio frame header, or return None if it isn't one."""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = (header[1] >> 3) & 3  # 3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5
+    layer = 4 - ((header[1] >> 1) & 3)
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    
+    mpeg1 = version == 3
+    bitrate = MPEG_BITRATES[(mpeg1, layer)][bitrate_index - 1] * 1000
+    rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // rate + padding
+    
+    return {'mpeg1': mpeg1, 'layer': layer, 'bitrate': bitrate, 'rate': rate, 'samples': samples,
+            'length': length, 'mono': header[3] >> 6 == 3}
+
+
+def mp3_duration(f, offset: int, size: int = None) -> float:
+    """Frame count from a Xing/Info or VBRI header, else (audio bytes / bitrate) for CBR files."""
+    frame = mpeg_frame(read_at(f, offset, 4))
+    if frame is None:
+        return None
+    data = read_at(f, offset, frame['length'])
+    
+    # Xing/Info follows the side information, whose size depends on version and channels
+    side_info = (17 if frame['mono'] else 32) if frame['mpeg1'] else (9 if frame['mono'] else 17)
+    xing = 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if not flags & 1:
+            return None
+        frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+        if flags & 2 and size is not None:
+            # A byte count far from the real size means the file was cut or appended to
+            stream_bytes = struct.unpack('>I', data[xing + 12:xing + 16])[0]
+            if abs(stream_bytes - (size - offset)) > 0.1 * stream_bytes:
+                return None
+        
+        samples = frames * frame['samples']
+        # A LAME tag after the optional byte count, TOC and quality fields gives the
+        # encoder delay and end padding, which decoders drop
+        lame = xing + 8 + sum(length for flag, length in ((1, 4), (2, 4), (4, 100), (8, 4)) if flags & flag)
+        if data[lame:lame + 4] in (b'LAME', b'Lavf', b'Lavc'):
+            gapless = int.from_bytes(data[lame + 21:lame + 24], 'big')
+            samples -= (gapless >> 12) + (gapless & 0xFFF)
+        return samples / frame['rate']
+    
+    if data[36:40] == b'VBRI':
+        frames = struct.unpack('>I', data[50:54])[0]
+        return frames * frame['samples'] / frame['rate']
+    
+    if size is None:
+        return None
+    # No header: assume CBR, but only if the next frame is where this one says it is
+    following = mpeg_frame(read_at(f, offset + frame['length'], 4))
+    if following is None or following['bitrate'] != frame['bitrate']:
+        return None
+    audio_bytes = size - offset
+    if read_at(f, size - 128, 3) == b'TAG':
+        audio_bytes -= 128
+    return audio_bytes * 8 / frame['bitrate']